@@ -1,19 +1,30 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Blueprint, Flask, abort, current_app, render_template, request, redirect, url_for, flash, session, jsonify, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from marshmallow import Schema, fields
 import os
+import base64
+import binascii
+import hashlib
 from werkzeug.utils import secure_filename
+from markupsafe import Markup
 from auth import auth_bp
 from dotenv import load_dotenv
 from webpay_plus import WebpayPlus
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
+from urllib.parse import urlencode
 import json
 from extensions import db
 from flask_mail import Mail, Message
-from datetime import datetime
+from datetime import datetime, timezone
 from flask_migrate import Migrate
-from currency_converter import CurrencyConverter
+from sqlalchemy import and_, case, func, select, text
+from sqlalchemy.orm import joinedload
+from circuit_breaker import CircuitOpenError
+from currency_converter import CURRENCY_SERIES, CurrencyConverter
+from rate_refresher import RateRefresher
+from catalog_cache import CatalogCache
 import logging
+import click
 from flasgger import Swagger
 
 # Configuración del logger
@@ -23,30 +34,16 @@ logger = logging.getLogger(__name__)
 # Cargar variables de entorno
 load_dotenv()
 
-app = Flask(__name__)
-app.secret_key = os.getenv("SECRET_KEY", "dev")
-
-# Registrar el blueprint de autenticación
-app.register_blueprint(auth_bp)
-
 # Configuración para subida de archivos
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-
-# Asegurarse de que el directorio de uploads existe
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Configuración de correo electrónico
-app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
-app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 587))
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
-app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
-app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
+# Extensiones; se asocian a la aplicación en create_app()
+mail = Mail()
+migrate = Migrate()
 
-# Inicializar Flask-Mail
-mail = Mail(app)
+# Rutas de la tienda (endpoints 'main.*')
+main = Blueprint('main', __name__, cli_group=None)
 
 # Definición del template Swagger
 swagger_template = {
@@ -94,34 +91,156 @@ swagger_template = {
     }
 }
 
-# Inicializar Flasgger para documentación Swagger
-swagger = Swagger(app, template=swagger_template)
-
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Configuración de la base de datos
-app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SESSION_PERMANENT'] = True
-app.config['PERMANENT_SESSION_LIFETIME'] = 86400  # 24 horas
+# Paginación del catálogo
+PRODUCTS_PAGE_SIZE = 50
+PRODUCTS_MAX_PAGE_SIZE = 200
+# Filas por lote del cursor de servidor en la exportación del catálogo
+PRODUCTS_EXPORT_BATCH_SIZE = int(os.getenv('PRODUCTS_EXPORT_BATCH_SIZE', '1000'))
 
-# Configuración de la URL base para Webpay
-app.config['BASE_URL'] = os.getenv('BASE_URL', 'http://localhost:5000')
+def encode_cursor(last_id):
+    """Codifica el último id entregado como cursor opaco"""
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode()
 
-# Inicializar extensiones
-db.init_app(app)
-migrate = Migrate(app, db)
+def decode_cursor(cursor):
+    """Decodifica un cursor de paginación; sin cursor se parte desde el inicio"""
+    if not cursor:
+        return 0
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError("Cursor inválido")
 
-# Inicializar Webpay Plus
-webpay = WebpayPlus(app)
+def parse_bool_arg(value):
+    """Interpreta un parámetro booleano de la query string (None si no viene)"""
+    if value is None or value == '':
+        return None
+    if value.lower() in ('1', 'true', 'si', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"Valor booleano inválido: {value}")
 
-# Inicializar el conversor de monedas
+# Inicializar Webpay Plus (el cliente de Transbank se crea en la primera transacción)
+webpay = WebpayPlus()
+
+# Inicializar el conversor de monedas (la caché y la API se usan recién al convertir)
 currency_converter = CurrencyConverter()
 
+# Precargar y refrescar las tasas en segundo plano (RATE_PREFETCH=false lo desactiva)
+RATE_PREFETCH = os.getenv('RATE_PREFETCH', 'true').lower() == 'true'
+rate_refresher = RateRefresher(currency_converter)
+
+# Caché de lectura del catálogo; create/update/delete de productos incrementan su versión
+catalog_cache = CatalogCache()
+
+@main.before_app_request
+def start_background_services():
+    """Inicia los hilos de fondo con la primera petición de cada worker y no al importar la app"""
+    if RATE_PREFETCH:
+        rate_refresher.start()
+
+def create_app(config=None):
+    """
+    Fábrica de la aplicación: configuración, extensiones y blueprints.
+    
+    No abre conexiones: la base de datos y los clientes externos se usan recién
+    en la primera petición o en init_worker(), lo que permite cargar la app
+    antes del fork (gunicorn --preload).
+    """
+    app = Flask(__name__)
+    app.secret_key = os.getenv("SECRET_KEY", "dev")
+
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    # Asegurarse de que el directorio de uploads existe
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+    # Configuración de correo electrónico
+    app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
+    app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 587))
+    app.config['MAIL_USE_TLS'] = True
+    app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
+    app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
+    app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
+
+    # Configuración de la base de datos
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SESSION_TYPE'] = 'filesystem'
+    app.config['SESSION_PERMANENT'] = True
+    app.config['PERMANENT_SESSION_LIFETIME'] = 86400  # 24 horas
+
+    # Configuración de la URL base para Webpay
+    app.config['BASE_URL'] = os.getenv('BASE_URL', 'http://localhost:5000')
+
+    if config:
+        app.config.update(config)
+
+    # Inicializar extensiones
+    db.init_app(app)
+    migrate.init_app(app, db)
+    mail.init_app(app)
+    webpay.init_app(app)
+
+    # Registrar los blueprints de autenticación y de la tienda
+    # (/logout solo existe en auth_bp)
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(main)
+
+    # Inicializar Flasgger para documentación Swagger
+    Swagger(app, template=swagger_template)
+    return app
+
+# Conexiones a la base de datos abiertas por init_worker() en cada worker
+DB_POOL_WARMUP = int(os.getenv('DB_POOL_WARMUP', '2'))
+
+def warm_templates(app):
+    """Compila las plantillas en el caché de Jinja; si se llama antes del fork, los workers lo comparten"""
+    count = 0
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        try:
+            app.jinja_env.get_template(name)
+            count += 1
+        except Exception as e:
+            logger.warning(f"No se pudo compilar la plantilla {name}: {str(e)}")
+    return count
+
+def init_worker(app):
+    """
+    Prepara un worker recién creado (hook post_fork de gunicorn).
+    
+    Descarta las conexiones heredadas del proceso padre, que no pueden
+    compartirse entre procesos, y precalienta el pool de conexiones, las
+    plantillas y las tasas de cambio antes de recibir tráfico.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False: las conexiones siguen siendo del padre, no se cierran aquí
+            engine.dispose(close=False)
+        try:
+            connections = [db.engine.connect() for _ in range(DB_POOL_WARMUP)]
+            for connection in connections:
+                connection.execute(text('SELECT 1'))
+                connection.close()
+        except Exception as e:
+            logger.warning(f"No se pudo precalentar el pool de conexiones: {str(e)}")
+    warm_templates(app)
+    loaded = currency_converter.load_cached_rates()
+    logger.info(f"Worker {os.getpid()} listo: {loaded} tasas de cambio cargadas desde la caché")
+    if RATE_PREFETCH:
+        rate_refresher.start()
+
 # Importar modelos después de inicializar db
 from models import Order, OrderItem, WebpayTransaction, Product, User, CartItem, Category
+from reconciliation import mark_transaction_failed, reconcile_orders_without_token, sweep_stale_transactions
+from stock import close_pending_orders, complete_order, reserve_stock
+from idempotency import idempotent, purge_idempotency_keys
+from email_outbox import enqueue_receipt, run_worker
+from rate_store import RateSourceError, get_rate_range
+from serializers import (CART_ITEM_COLUMNS, EXPORT_COLUMNS, PRODUCT_COLUMNS, PRODUCT_FIELDS, cart_item_from_row,
+                         dumps, json_response, ndjson_chunk, product_from_row)
 
 # Esquemas para serialización
 class ProductSchema(Schema):
@@ -144,57 +263,140 @@ products_schema = ProductSchema(many=True)
 cart_item_schema = CartItemSchema()
 cart_items_schema = CartItemSchema(many=True)
 
+# Datos del catálogo que se guardan en catalog_cache (las plantillas los usan como objetos)
+def product_to_dict(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': product.price,
+        'image': product.image,
+        'description': product.description,
+        'is_featured': product.is_featured,
+        'is_promotion': product.is_promotion,
+        'promotion_price': product.promotion_price,
+        'category_id': product.category_id,
+        # Versión de la fila (segundos desde epoch) para ETag y Last-Modified
+        'updated_at': product.updated_at.timestamp() if product.updated_at else None
+    }
+
+def category_to_dict(category):
+    return {
+        'id': category.id,
+        'name': category.name,
+        'description': category.description,
+        'icon': category.icon
+    }
+
+def load_product(product_id):
+    """Producto desde la caché del catálogo; None si no existe"""
+    def load():
+        product = Product.query.get(product_id)
+        return product_to_dict(product) if product else None
+    return catalog_cache.get_or_load(f'product:{product_id}', load)
+
+def rows_etag(rows):
+    """ETag fuerte a partir de las versiones (id, updated_at) de las filas entregadas"""
+    versions = ','.join(f"{row['id']}:{row.get('updated_at')}" for row in rows)
+    return hashlib.sha1(versions.encode()).hexdigest()
+
+def catalog_json(etag, build_json, last_modified=None):
+    """
+    Respuesta JSON del catálogo con validadores.
+    
+    If-None-Match (o If-Modified-Since si no viene) se compara antes de llamar
+    a build_json(), que devuelve el JSON ya codificado: si el cliente ya tiene
+    esta versión se responde 304 sin serializar nada.
+    """
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified is not None:
+        # Las fechas HTTP tienen resolución de segundos
+        not_modified = int(last_modified) <= request.if_modified_since.timestamp()
+    else:
+        not_modified = False
+
+    response = current_app.response_class(status=304) if not_modified else json_response(build_json())
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = datetime.fromtimestamp(int(last_modified), timezone.utc)
+    # Los clientes (POS, app móvil) pueden guardar la respuesta pero deben revalidarla
+    response.cache_control.no_cache = True
+    return response
+
 # rutas
 # HOME
-@app.route('/')
+@main.route('/')
 def home():
     # Obtener información del usuario desde la sesión
     user = session.get('user') if 'user' in session else None
     
-    # Obtener todas las categorías
-    categories = Category.query.all()
-    
-    # Obtener productos destacados
-    featured_products = Product.query.filter_by(is_featured=True).limit(8).all()
-    
-    # Obtener productos en promoción
-    promotion_products = Product.query.filter_by(is_promotion=True).limit(6).all()
+    # Las secciones del catálogo son iguales para todos los visitantes: se cachea
+    # su HTML por versión del catálogo y solo el encabezado (usuario) se renderiza
+    fragments = catalog_cache.get_or_load('fragments:home', render_home_fragments)
     
     return render_template('index.html', 
                          user=user,
-                         categories=categories,
-                         featured_products=featured_products,
-                         promotion_products=promotion_products)
+                         fragments={name: Markup(html) for name, html in fragments.items()})
+
+def load_home_catalog():
+    def load():
+        return {
+            # Obtener todas las categorías
+            'categories': [category_to_dict(c) for c in Category.query.all()],
+            # Obtener productos destacados
+            'featured_products': [product_to_dict(p) for p in Product.query.filter_by(is_featured=True).limit(8).all()],
+            # Obtener productos en promoción
+            'promotion_products': [product_to_dict(p) for p in Product.query.filter_by(is_promotion=True).limit(6).all()]
+        }
+    return catalog_cache.get_or_load('home', load)
+
+def render_home_fragments():
+    """HTML de las secciones del inicio (categorías, destacados y promociones)"""
+    catalog = load_home_catalog()
+    return {
+        'categories': render_template('partials/home_categories.html', categories=catalog['categories']),
+        'featured': render_template('partials/home_featured.html', featured_products=catalog['featured_products']),
+        'promotions': render_template('partials/home_promotions.html', promotion_products=catalog['promotion_products'])
+    }
 
 # Ruta para ver productos por categoría
-@app.route('/categoria/<int:category_id>')
+@main.route('/categoria/<int:category_id>')
 def category_products(category_id):
-    category = Category.query.get_or_404(category_id)
-    products = Product.query.filter_by(category_id=category_id).all()
+    def load():
+        category = Category.query.get(category_id)
+        if category is None:
+            return None
+        products = Product.query.filter_by(category_id=category_id).all()
+        return {'category': category_to_dict(category), 'products': [product_to_dict(p) for p in products]}
+    catalog = catalog_cache.get_or_load(f'category:{category_id}', load)
+    if catalog is None:
+        abort(404)
     user = session.get('user') if 'user' in session else None
     
     return render_template('category_products.html',
-                         category=category,
-                         products=products,
+                         category=catalog['category'],
+                         products=catalog['products'],
                          user=user)
 
 # PRODUCT DETAIL
-@app.route('/product/<int:product_id>')
+@main.route('/product/<int:product_id>')
 def product_detail(product_id):
-    product = Product.query.get_or_404(product_id)
+    product = load_product(product_id)
+    if product is None:
+        abort(404)
     # Obtener información del usuario desde la sesión
     user = session.get('user') if 'user' in session else None
     return render_template('product_detail.html', product=product, user=user)
 
 # CART
-@app.route('/carrito')
+@main.route('/carrito')
 def carrito():
     # Obtener información del usuario desde la sesión
     user = session.get('user') if 'user' in session else None
     return render_template('cart.html', user=user)
 
 #LOGIN
-@app.route('/login', methods=['GET', 'POST'])
+@main.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
          email = request.form.get('email')
@@ -208,21 +410,13 @@ def login():
              }
              session['user_id'] = user.id
              flash('¡Inicio de sesión exitoso!', 'success')
-             return redirect(url_for('home'))
+             return redirect(url_for('main.home'))
          else:
              flash('Credenciales inválidas. Por favor, intenta de nuevo.', 'danger')
     return render_template('login.html')
 
-#LOGOUT
-@app.route('/logout')
-def logout():
-    session.pop('user', None)
-    session.pop('user_id', None)
-    flash('You have been logged out.', 'success')
-    return redirect(url_for('home'))
-
 # REGISTER
-@app.route('/register', methods=['GET', 'POST'])
+@main.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         try:
@@ -233,29 +427,29 @@ def register():
             # Validar campos requeridos
             if not all([username, password, email]):
                 flash('Todos los campos son requeridos', 'danger')
-                return redirect(url_for('register'))
+                return redirect(url_for('main.register'))
 
             # Validar formato de email
             if '@' not in email or '.' not in email:
                 flash('Por favor, ingrese un email válido', 'danger')
-                return redirect(url_for('register'))
+                return redirect(url_for('main.register'))
 
             # Validar longitud de contraseña
             if len(password) < 6:
                 flash('La contraseña debe tener al menos 6 caracteres', 'danger')
-                return redirect(url_for('register'))
+                return redirect(url_for('main.register'))
 
             # Check if the username already exists
             existing_user = User.query.filter_by(username=username).first()
             if existing_user:
                 flash('El nombre de usuario ya existe. Por favor, elija otro.', 'danger')
-                return redirect(url_for('register'))
+                return redirect(url_for('main.register'))
 
             # Check if the email already exists
             existing_email = User.query.filter_by(email=email).first()
             if existing_email:
                 flash('El email ya está registrado. Por favor, use otro.', 'danger')
-                return redirect(url_for('register'))
+                return redirect(url_for('main.register'))
 
             # Hash the password and create a new user
             hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
@@ -269,40 +463,180 @@ def register():
                 db.session.add(new_user)
                 db.session.commit()
                 flash('¡Registro exitoso! Ahora puede iniciar sesión.', 'success')
-                return redirect(url_for('login'))
+                return redirect(url_for('main.login'))
             except Exception as e:
                 db.session.rollback()
                 logger.error(f"Error al crear usuario: {str(e)}")
                 flash('Error al crear la cuenta. Por favor, intente nuevamente.', 'danger')
-                return redirect(url_for('register'))
+                return redirect(url_for('main.register'))
 
         except Exception as e:
             logger.error(f"Error en el registro: {str(e)}")
             flash('Error al procesar el registro. Por favor, intente nuevamente.', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
     return render_template('register.html')
 
 # Rutas de la API
-@app.route('/api/products', methods=['GET'])
+@main.route('/api/products', methods=['GET'])
 def get_products():
     """
-    Obtener todos los productos
+    Obtener productos paginados (keyset sobre id)
     ---
     tags:
       - Productos
+    parameters:
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: Cursor opaco devuelto como next_cursor en la página anterior
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Cantidad de productos por página (máximo 200)
+      - name: category_id
+        in: query
+        type: integer
+        required: false
+      - name: is_promotion
+        in: query
+        type: boolean
+        required: false
+      - name: is_featured
+        in: query
+        type: boolean
+        required: false
+      - name: min_price
+        in: query
+        type: number
+        required: false
+      - name: max_price
+        in: query
+        type: number
+        required: false
+      - name: If-None-Match
+        in: header
+        type: string
+        required: false
+        description: ETag de una respuesta anterior; si no hubo cambios se responde 304
     responses:
       200:
-        description: Lista de productos
+        description: Página de productos
         schema:
-          type: array
-          items:
-            $ref: '#/definitions/Product'
+          type: object
+          properties:
+            items:
+              type: array
+              items:
+                $ref: '#/definitions/Product'
+            next_cursor:
+              type: string
+      304:
+        description: La página no cambió desde el ETag indicado
+      400:
+        description: Parámetros inválidos
     """
-    products = Product.query.all()
-    return jsonify(products_schema.dump(products))
+    try:
+        limit = min(int(request.args.get('limit', PRODUCTS_PAGE_SIZE)), PRODUCTS_MAX_PAGE_SIZE)
+        if limit <= 0:
+            raise ValueError(limit)
+        after_id = decode_cursor(request.args.get('cursor'))
+        query = Product.query.filter(Product.id > after_id)
+        # Valores ya interpretados; solo ellos forman la clave de caché
+        params = {'after_id': after_id, 'limit': limit}
+
+        category_id = request.args.get('category_id', type=int)
+        if category_id is not None:
+            query = query.filter(Product.category_id == category_id)
+            params['category_id'] = category_id
+        for flag in ('is_promotion', 'is_featured'):
+            value = parse_bool_arg(request.args.get(flag))
+            if value is not None:
+                query = query.filter(getattr(Product, flag) == value)
+                params[flag] = value
+        if request.args.get('min_price'):
+            params['min_price'] = float(request.args['min_price'])
+            query = query.filter(Product.price >= params['min_price'])
+        if request.args.get('max_price'):
+            params['max_price'] = float(request.args['max_price'])
+            query = query.filter(Product.price <= params['max_price'])
+    except (TypeError, ValueError):
+        return jsonify({"error": "Parámetros de paginación o filtro inválidos"}), 400
+
+    def load_page():
+        # Se pide un registro extra para saber si existe una página siguiente;
+        # solo las columnas de la respuesta, como tuplas (sin objetos del ORM)
+        rows = (query.with_entities(*PRODUCT_COLUMNS, Product.updated_at)
+                .order_by(Product.id).limit(limit + 1).all())
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].id)
+        versions = [{'id': row.id, 'updated_at': row.updated_at.timestamp() if row.updated_at else None} for row in rows]
+        return {
+            # El cursor también forma parte de la representación
+            'etag': rows_etag(versions + [{'id': next_cursor}]),
+            # Se guarda ya codificado: los aciertos de caché no vuelven a serializar
+            'json': dumps({
+                'items': [product_from_row(row) for row in rows],
+                'next_cursor': next_cursor
+            })
+        }
+
+    # Los parámetros desconocidos no crean entradas nuevas en la caché
+    page = catalog_cache.get_or_load(f"products?{urlencode(sorted(params.items()))}", load_page)
+    # Sin Last-Modified: al eliminar un producto la página cambia sin que suba el máximo de updated_at
+    return catalog_json(page['etag'], lambda: page['json'])
 
-@app.route('/api/products/<int:id>', methods=['GET'])
+@main.route('/api/products/export', methods=['GET'])
+def export_products():
+    """
+    Exportar el catálogo completo como NDJSON (sincronización con el ERP)
+    ---
+    tags:
+      - Productos
+    produces:
+      - application/x-ndjson
+    parameters:
+      - name: category_id
+        in: query
+        type: integer
+        required: false
+    responses:
+      200:
+        description: Un producto JSON por línea, ordenados por id
+        schema:
+          $ref: '#/definitions/Product'
+      400:
+        description: Parámetros inválidos
+    """
+    category_id = request.args.get('category_id', type=int)
+    if 'category_id' in request.args and category_id is None:
+        return jsonify({"error": "Parámetros de filtro inválidos"}), 400
+
+    statement = select(*EXPORT_COLUMNS).order_by(Product.id)
+    if category_id is not None:
+        statement = statement.where(Product.category_id == category_id)
+
+    def generate():
+        # yield_per usa un cursor de servidor (stream_results) y trae los
+        # productos por lotes: la memoria no crece con el tamaño del catálogo
+        # y el cliente recibe el primer lote sin esperar al resto
+        result = db.session.execute(statement.execution_options(yield_per=PRODUCTS_EXPORT_BATCH_SIZE))
+        try:
+            for rows in result.partitions():
+                yield ndjson_chunk(rows)
+        finally:
+            result.close()
+
+    # Sin catalog_cache ni ETag: la respuesta no se arma completa en memoria
+    response = current_app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename=productos.ndjson'
+    return response
+
+@main.route('/api/products/<int:id>', methods=['GET'])
 def get_product(id):
     """
     Obtener un producto por ID
@@ -315,18 +649,33 @@ def get_product(id):
         type: integer
         required: true
         description: ID del producto
+      - name: If-None-Match
+        in: header
+        type: string
+        required: false
+        description: ETag de una respuesta anterior; si no hubo cambios se responde 304
+      - name: If-Modified-Since
+        in: header
+        type: string
+        required: false
     responses:
       200:
         description: Producto encontrado
         schema:
           $ref: '#/definitions/Product'
+      304:
+        description: El producto no cambió
       404:
         description: Producto no encontrado
     """
-    product = Product.query.get_or_404(id)
-    return jsonify(product_schema.dump(product))
+    product = load_product(id)
+    if product is None:
+        abort(404)
+    return catalog_json(
+        rows_etag([product]), lambda: dumps({field: product[field] for field in PRODUCT_FIELDS}), product['updated_at']
+    )
 
-@app.route('/api/products', methods=['POST'])
+@main.route('/api/products', methods=['POST'])
 def create_product():
     name = request.form.get('name')
     price = float(request.form.get('price'))
@@ -338,8 +687,8 @@ def create_product():
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
             # Asegurarse de que el directorio existe
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
             file.save(file_path)
             image_path = f'uploads/{filename}'
     elif 'imageUrl' in request.form and request.form.get('imageUrl'):
@@ -353,10 +702,11 @@ def create_product():
     
     db.session.add(new_product)
     db.session.commit()
+    catalog_cache.bump()
     
     return jsonify(product_schema.dump(new_product)), 201
 
-@app.route('/api/products/<int:id>', methods=['PUT'])
+@main.route('/api/products/<int:id>', methods=['PUT'])
 def update_product(id):
     product = Product.query.get_or_404(id)
     
@@ -369,25 +719,46 @@ def update_product(id):
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
             # Asegurarse de que el directorio existe
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
             file.save(file_path)
             product.image = f'uploads/{filename}'
     elif 'imageUrl' in request.form and request.form.get('imageUrl'):
         product.image = request.form.get('imageUrl')
     
     db.session.commit()
+    catalog_cache.bump()
     return jsonify(product_schema.dump(product))
 
-@app.route('/api/products/<int:id>', methods=['DELETE'])
+@main.route('/api/products/<int:id>', methods=['DELETE'])
 def delete_product(id):
     product = Product.query.get_or_404(id)
     db.session.delete(product)
     db.session.commit()
+    catalog_cache.bump()
     return '', 204
 
 # API para el Carrito de Compras
-@app.route('/api/cart', methods=['GET'])
+CART_BATCH_MAX_OPERATIONS = 500
+
+def load_cart(user_id):
+    """Carga los items del carrito junto a sus productos en una sola consulta (JOIN)"""
+    return (CartItem.query
+            .options(joinedload(CartItem.product))
+            .filter_by(user_id=user_id)
+            .order_by(CartItem.id)
+            .all())
+
+def load_cart_json(user_id):
+    """Carrito serializado sin objetos del ORM: mismos campos que cart_items_schema"""
+    rows = (db.session.query(*CART_ITEM_COLUMNS, *PRODUCT_COLUMNS)
+            .outerjoin(Product, CartItem.product_id == Product.id)
+            .filter(CartItem.user_id == user_id)
+            .order_by(CartItem.id)
+            .all())
+    return json_response([cart_item_from_row(row) for row in rows])
+
+@main.route('/api/cart', methods=['GET'])
 def get_cart():
     """
     Obtener el carrito del usuario autenticado
@@ -407,20 +778,61 @@ def get_cart():
     if not session.get('user_id'):
         return jsonify({"error": "Usuario no autenticado"}), 401
     
-    user_id = session.get('user_id')
-    cart_items = CartItem.query.filter_by(user_id=user_id).all()
+    return load_cart_json(session.get('user_id'))
+
+@main.route('/api/cart/summary', methods=['GET'])
+def get_cart_summary():
+    """
+    Obtener el resumen del carrito (contador del navbar)
+    ---
+    tags:
+      - Carrito
+    responses:
+      200:
+        description: Resumen del carrito
+        schema:
+          type: object
+          properties:
+            item_count:
+              type: integer
+            line_count:
+              type: integer
+            subtotal:
+              type: number
+      304:
+        description: El resumen no ha cambiado (If-None-Match)
+      401:
+        description: Usuario no autenticado
+    """
+    if not session.get('user_id'):
+        return jsonify({"error": "Usuario no autenticado"}), 401
     
-    # Incluir información del producto en cada item del carrito
-    result = []
-    for item in cart_items:
-        item_data = cart_item_schema.dump(item)
-        product = Product.query.get(item.product_id)
-        item_data['product'] = product_schema.dump(product)
-        result.append(item_data)
+    # Una sola consulta agregada, sin materializar objetos del ORM
+    unit_price = case(
+        (and_(Product.is_promotion.is_(True), Product.promotion_price.isnot(None)), Product.promotion_price),
+        else_=Product.price
+    )
+    item_count, line_count, subtotal = (db.session.query(
+            func.coalesce(func.sum(CartItem.quantity), 0),
+            func.count(CartItem.id),
+            func.coalesce(func.sum(CartItem.quantity * unit_price), 0))
+        .join(Product, CartItem.product_id == Product.id)
+        .filter(CartItem.user_id == session['user_id'])
+        .one())
     
-    return jsonify(result)
+    summary = {
+        'item_count': int(item_count),
+        'line_count': int(line_count),
+        'subtotal': round(float(subtotal), 2)
+    }
+    response = jsonify(summary)
+    response.set_etag(hashlib.sha1(json.dumps(summary, sort_keys=True).encode()).hexdigest())
+    # El navegador debe revalidar siempre; la respuesta depende del usuario
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
-@app.route('/api/cart/add', methods=['POST'])
+@main.route('/api/cart/add', methods=['POST'])
 def add_to_cart():
     if not session.get('user_id'):
         return jsonify({"error": "Usuario no autenticado"}), 401
@@ -443,35 +855,31 @@ def add_to_cart():
         
         logger.info(f"Intentando añadir producto {product_id} al carrito del usuario {user_id}")
         
+        if quantity <= 0:
+            raise ValueError(f"Cantidad inválida: {quantity}")
+        
         # Validar que el producto existe
         product = Product.query.get(product_id)
         if not product:
             logger.error(f"Producto {product_id} no encontrado")
             return jsonify({"error": "Producto no encontrado"}), 404
+        product_data = product_schema.dump(product)
         
-        # Validar que hay stock disponible
-        if product.stock < quantity:
+        # Insertar o incrementar en una sola sentencia; el stock se valida en la BD
+        cart_row = CartItem.add_quantity(user_id, product_id, quantity)
+        if cart_row is None:
+            db.session.rollback()
             logger.error(f"Stock insuficiente para el producto {product_id}")
             return jsonify({"error": "No hay suficiente stock disponible"}), 400
-        
-        # Verificar si el producto ya está en el carrito
-        cart_item = CartItem.query.filter_by(user_id=user_id, product_id=product_id).first()
-        
-        if cart_item:
-            # Actualizar cantidad si ya existe
-            cart_item.quantity += quantity
-            logger.info(f"Actualizada cantidad del producto {product_id} en el carrito")
-        else:
-            # Crear nuevo item en el carrito
-            cart_item = CartItem(user_id=user_id, product_id=product_id, quantity=quantity)
-            db.session.add(cart_item)
-            logger.info(f"Añadido nuevo producto {product_id} al carrito")
-        
         db.session.commit()
         
-        # Incluir información del producto en la respuesta
-        item_data = cart_item_schema.dump(cart_item)
-        item_data['product'] = product_schema.dump(product)
+        item_data = {
+            'id': cart_row.id,
+            'user_id': user_id,
+            'product_id': product_id,
+            'quantity': cart_row.quantity,
+            'product': product_data
+        }
         
         logger.info(f"Producto {product_id} añadido exitosamente al carrito")
         return jsonify(item_data), 201
@@ -484,7 +892,7 @@ def add_to_cart():
         db.session.rollback()
         return jsonify({"error": "Error interno del servidor"}), 500
 
-@app.route('/api/cart/update/<int:item_id>', methods=['PUT'])
+@main.route('/api/cart/update/<int:item_id>', methods=['PUT'])
 def update_cart_item(item_id):
     if not session.get('user_id'):
         return jsonify({"error": "Usuario no autenticado"}), 401
@@ -496,8 +904,11 @@ def update_cart_item(item_id):
     user_id = session.get('user_id')
     quantity = data['quantity']
     
-    # Buscar el item en el carrito
-    cart_item = CartItem.query.filter_by(id=item_id, user_id=user_id).first()
+    # Buscar el item en el carrito junto a su producto
+    cart_item = (CartItem.query
+                 .options(joinedload(CartItem.product))
+                 .filter_by(id=item_id, user_id=user_id)
+                 .first())
     if not cart_item:
         return jsonify({"error": "Item no encontrado en el carrito"}), 404
     
@@ -509,16 +920,12 @@ def update_cart_item(item_id):
     
     # Actualizar la cantidad
     cart_item.quantity = quantity
-    db.session.commit()
-    
-    # Incluir información del producto en la respuesta
-    product = Product.query.get(cart_item.product_id)
     item_data = cart_item_schema.dump(cart_item)
-    item_data['product'] = product_schema.dump(product)
+    db.session.commit()
     
     return jsonify(item_data)
 
-@app.route('/api/cart/remove/<int:item_id>', methods=['DELETE'])
+@main.route('/api/cart/remove/<int:item_id>', methods=['DELETE'])
 def remove_from_cart(item_id):
     if not session.get('user_id'):
         return jsonify({"error": "Usuario no autenticado"}), 401
@@ -536,7 +943,104 @@ def remove_from_cart(item_id):
     
     return '', 204
 
-@app.route('/api/cart/clear', methods=['DELETE'])
+@main.route('/api/cart/batch', methods=['POST'])
+def batch_cart():
+    """
+    Aplicar varias operaciones sobre el carrito en una sola transacción
+    ---
+    tags:
+      - Carrito
+    consumes:
+      - application/json
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - operations
+          properties:
+            operations:
+              type: array
+              items:
+                type: object
+                properties:
+                  op:
+                    type: string
+                    enum: [add, update, remove]
+                  product_id:
+                    type: integer
+                    description: Requerido para add
+                  item_id:
+                    type: integer
+                    description: Requerido para update y remove
+                  quantity:
+                    type: integer
+    responses:
+      200:
+        description: Carrito resultante
+        schema:
+          type: array
+          items:
+            $ref: '#/definitions/CartItem'
+      400:
+        description: Operación inválida; no se aplica ningún cambio
+      401:
+        description: Usuario no autenticado
+    """
+    if not session.get('user_id'):
+        return jsonify({"error": "Usuario no autenticado"}), 401
+    
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "Se requiere una lista de operaciones"}), 400
+    if len(operations) > CART_BATCH_MAX_OPERATIONS:
+        return jsonify({"error": f"Máximo {CART_BATCH_MAX_OPERATIONS} operaciones por solicitud"}), 400
+    
+    user_id = session.get('user_id')
+    # Una sola consulta para todos los items existentes; los cambios se envían juntos al commit
+    items_by_id = {item.id: item for item in CartItem.query.filter_by(user_id=user_id).all()}
+    
+    def batch_error(index, message, status=400):
+        db.session.rollback()
+        return jsonify({"error": message, "index": index}), status
+    
+    try:
+        for index, operation in enumerate(operations):
+            op = operation.get('op') if isinstance(operation, dict) else None
+            if op == 'add':
+                quantity = int(operation.get('quantity', 1))
+                if quantity <= 0:
+                    return batch_error(index, "Datos inválidos")
+                if CartItem.add_quantity(user_id, int(operation['product_id']), quantity) is None:
+                    return batch_error(index, "Producto no encontrado o sin stock suficiente")
+            elif op in ('update', 'remove'):
+                cart_item = items_by_id.get(int(operation['item_id']))
+                if cart_item is None:
+                    return batch_error(index, "Item no encontrado en el carrito", 404)
+                quantity = 0 if op == 'remove' else int(operation['quantity'])
+                if quantity <= 0:
+                    db.session.delete(cart_item)
+                    del items_by_id[cart_item.id]
+                else:
+                    cart_item.quantity = quantity
+            else:
+                return batch_error(index, f"Operación no soportada: {op}")
+    except (KeyError, TypeError, ValueError):
+        return batch_error(index, "Datos inválidos")
+    
+    try:
+        db.session.commit()
+    except Exception as e:
+        logger.error(f"Error al aplicar operaciones del carrito: {str(e)}")
+        db.session.rollback()
+        return jsonify({"error": "Error interno del servidor"}), 500
+    
+    return load_cart_json(user_id)
+
+@main.route('/api/cart/clear', methods=['DELETE'])
 def clear_cart():
     if not session.get('user_id'):
         return jsonify({"error": "Usuario no autenticado"}), 401
@@ -550,7 +1054,8 @@ def clear_cart():
     return '', 204
 
 # Rutas de Webpay
-@app.route('/iniciar-pago', methods=['POST'])
+@main.route('/iniciar-pago', methods=['POST'])
+@idempotent('iniciar-pago')
 def iniciar_pago():
     print("\n=== INICIANDO PROCESO DE PAGO ===")
     if not session.get('user_id'):
@@ -559,25 +1064,38 @@ def iniciar_pago():
     
     try:
         print(f"Usuario autenticado: {session['user_id']}")
-        # Obtener items del carrito
-        cart_items = CartItem.query.filter_by(user_id=session['user_id']).all()
+        # Obtener items del carrito junto a sus productos (una sola consulta)
+        cart_items = load_cart(session['user_id'])
         if not cart_items:
             print("Error: Carrito vacío")
             return jsonify({'error': 'Carrito vacío'}), 400
         
         print("Calculando total de la compra...")
-        # Calcular total usando precio de promoción si corresponde
-        def get_precio_producto(item):
-            producto = item.product
+        # Precio unitario usando precio de promoción si corresponde
+        def get_precio_producto(producto):
             if getattr(producto, 'is_promotion', False) and getattr(producto, 'promotion_price', None) is not None:
-                return item.quantity * producto.promotion_price
-            return item.quantity * producto.price
-        total = sum(get_precio_producto(item) for item in cart_items)
+                return producto.promotion_price
+            return producto.price
+        order_lines = [
+            {
+                'product_id': item.product_id,
+                'quantity': item.quantity,
+                'price_at_time': get_precio_producto(item.product)
+            }
+            for item in cart_items
+        ]
+        total = sum(line['quantity'] * line['price_at_time'] for line in order_lines)
         print(f"Total calculado: {total}")
         
         print("Creando orden en la base de datos...")
         try:
-            # Crear orden
+            # Reservar el stock de todas las líneas con un solo UPDATE condicional
+            if not reserve_stock((line['product_id'], line['quantity']) for line in order_lines):
+                db.session.rollback()
+                print("Error: Stock insuficiente")
+                return jsonify({'error': 'No hay suficiente stock disponible'}), 400
+            
+            # Crear orden (el flush es necesario para conocer su id)
             order = Order(
                 user_id=session['user_id'],
                 total_amount=total,
@@ -587,21 +1105,11 @@ def iniciar_pago():
             db.session.flush()
             print(f"Orden creada con ID: {order.id}")
             
-            # Crear items de la orden
-            print("Creando items de la orden...")
-            for cart_item in cart_items:
-                producto = cart_item.product
-                if getattr(producto, 'is_promotion', False) and getattr(producto, 'promotion_price', None) is not None:
-                    precio_usado = producto.promotion_price
-                else:
-                    precio_usado = producto.price
-                order_item = OrderItem(
-                    order=order,
-                    product_id=cart_item.product_id,
-                    quantity=cart_item.quantity,
-                    price_at_time=precio_usado
-                )
-                db.session.add(order_item)
+            # Insertar todos los items de la orden en un solo INSERT masivo
+            print(f"Creando {len(order_lines)} items de la orden...")
+            for line in order_lines:
+                line['order_id'] = order.id
+            db.session.execute(db.insert(OrderItem), order_lines)
             
             # Generar orden de compra única
             buy_order = f"OC-{order.id}"
@@ -616,57 +1124,11 @@ def iniciar_pago():
                 session_id=str(session['user_id'])
             )
             db.session.add(transaction)
+            db.session.flush()
+            transaction_id = transaction.id
             db.session.commit()
             print("Transacción creada en la base de datos")
             
-            # Iniciar transacción en Webpay
-            return_url = url_for('retorno_webpay', _external=True)
-            print(f"URL de retorno configurada: {return_url}")
-            
-            try:
-                print("\n=== INICIANDO TRANSACCIÓN EN WEBPAY ===")
-                print("Datos que se enviarán a Webpay:")
-                print(f"- Monto: {int(total)}")
-                print(f"- Orden de compra: {buy_order}")
-                print(f"- ID de sesión: {str(session['user_id'])}")
-                print(f"- URL de retorno: {return_url}")
-                
-                webpay_response = webpay.create_transaction(
-                    amount=int(total),
-                    buy_order=buy_order,
-                    session_id=str(session['user_id']),
-                    return_url=return_url
-                )
-                
-                print("\nRespuesta de Webpay recibida:")
-                print(webpay_response)
-                
-                if not webpay_response or 'token' not in webpay_response or 'url' not in webpay_response:
-                    raise ValueError("Respuesta inválida de Webpay")
-                
-                # Actualizar transacción con el token
-                transaction.token_ws = webpay_response['token']
-                db.session.commit()
-                print("Token guardado en la base de datos")
-                
-                # Vaciar el carrito
-                CartItem.query.filter_by(user_id=session['user_id']).delete()
-                db.session.commit()
-                print("Carrito vaciado")
-                
-                print("\n=== PROCESO DE INICIO DE PAGO COMPLETADO ===")
-                return jsonify(webpay_response)
-                
-            except Exception as e:
-                print("\n=== ERROR AL CREAR TRANSACCIÓN WEBPAY ===")
-                print(f"Error: {str(e)}")
-                print(f"Tipo de error: {type(e)}")
-                import traceback
-                print("Traceback completo:")
-                print(traceback.format_exc())
-                db.session.rollback()
-                return jsonify({'error': 'Error al procesar el pago con Webpay'}), 500
-            
         except Exception as e:
             print("\n=== ERROR AL CREAR ORDEN ===")
             print(f"Error: {str(e)}")
@@ -676,48 +1138,76 @@ def iniciar_pago():
             print(traceback.format_exc())
             db.session.rollback()
             return jsonify({'error': 'Error al crear la orden'}), 500
-            
-    except Exception as e:
-        print("\n=== ERROR GENERAL ===")
-        print(f"Error: {str(e)}")
-        print(f"Tipo de error: {type(e)}")
-        import traceback
-        print("Traceback completo:")
-        print(traceback.format_exc())
-        db.session.rollback()
-        return jsonify({'error': 'Error al procesar el pago'}), 500
-
-def enviar_comprobante(order, user_email):
-    """Envía el comprobante de pago por correo electrónico"""
-    try:
-        print("\n=== ENVIANDO COMPROBANTE POR EMAIL ===")
-        print(f"Enviando comprobante a: {user_email}")
         
-        msg = Message(
-            'Comprobante de Pago - Ferremas',
-            recipients=[user_email]
-        )
+        # Devolver la conexión al pool mientras se espera a Transbank
+        db.session.close()
         
-        # Renderizar el template HTML con los datos de la orden
-        html = render_template(
-            'email/comprobante.html',
-            order=order,
-            current_year=datetime.now().year
-        )
+        # Iniciar transacción en Webpay
+        return_url = url_for('main.retorno_webpay', _external=True)
+        print(f"URL de retorno configurada: {return_url}")
         
-        msg.html = html
-        mail.send(msg)
-        print("Correo enviado exitosamente")
+        try:
+            print("\n=== INICIANDO TRANSACCIÓN EN WEBPAY ===")
+            print("Datos que se enviarán a Webpay:")
+            print(f"- Monto: {int(total)}")
+            print(f"- Orden de compra: {buy_order}")
+            print(f"- ID de sesión: {str(session['user_id'])}")
+            print(f"- URL de retorno: {return_url}")
+            
+            webpay_response = webpay.create_transaction(
+                amount=int(total),
+                buy_order=buy_order,
+                session_id=str(session['user_id']),
+                return_url=return_url
+            )
+            
+            print("\nRespuesta de Webpay recibida:")
+            print(webpay_response)
+            
+            if not webpay_response or 'token' not in webpay_response or 'url' not in webpay_response:
+                raise ValueError("Respuesta inválida de Webpay")
+            
+        except Exception as e:
+            print("\n=== ERROR AL CREAR TRANSACCIÓN WEBPAY ===")
+            print(f"Error: {str(e)}")
+            print(f"Tipo de error: {type(e)}")
+            import traceback
+            print("Traceback completo:")
+            print(traceback.format_exc())
+            # Si esto también falla, reconcile_orders_without_token() la cerrará después
+            mark_transaction_failed(transaction_id)
+            return jsonify({'error': 'Error al procesar el pago con Webpay'}), 500
+        
+        try:
+            # Transacción corta: guardar el token y vaciar el carrito
+            WebpayTransaction.query.filter_by(id=transaction_id).update(
+                {'token_ws': webpay_response['token'], 'status': 'pending'},
+                synchronize_session=False)
+            CartItem.query.filter_by(user_id=session['user_id']).delete()
+            db.session.commit()
+            print("Token guardado y carrito vaciado")
+        except Exception as e:
+            print("\n=== ERROR AL GUARDAR TOKEN ===")
+            print(f"Error: {str(e)}")
+            db.session.rollback()
+            # retorno_webpay() puede recuperar la transacción por buy_order si el
+            # usuario llega a pagar; si no, la reconciliación la marcará fallida
+            return jsonify({'error': 'Error al procesar el pago con Webpay'}), 500
         
+        print("\n=== PROCESO DE INICIO DE PAGO COMPLETADO ===")
+        return jsonify(webpay_response)
+            
     except Exception as e:
-        print("\n=== ERROR AL ENVIAR CORREO ===")
+        print("\n=== ERROR GENERAL ===")
         print(f"Error: {str(e)}")
         print(f"Tipo de error: {type(e)}")
         import traceback
         print("Traceback completo:")
         print(traceback.format_exc())
+        db.session.rollback()
+        return jsonify({'error': 'Error al procesar el pago'}), 500
 
-@app.route('/retorno-webpay', methods=['GET', 'POST'])
+@main.route('/retorno-webpay', methods=['GET', 'POST'])
 def retorno_webpay():
     print("\n=== PROCESANDO RETORNO DE WEBPAY ===")
     print("Método:", request.method)
@@ -733,18 +1223,18 @@ def retorno_webpay():
     
     if tbk_token:
         print("Pago abortado por el usuario")
-        # Pago abortado por el usuario
-        transaction = WebpayTransaction.query.filter_by(token_ws=token_ws).first()
+        # Pago abortado por el usuario (Webpay envía el token en TBK_TOKEN)
+        transaction = WebpayTransaction.query.filter_by(token_ws=token_ws or tbk_token).first()
         if transaction:
             transaction.status = 'cancelled'
-            transaction.order.status = 'cancelled'
+            close_pending_orders([transaction.order_id], 'cancelled')
             db.session.commit()
             print("Transacción marcada como cancelada")
-        return redirect(url_for('comprobante_pago', status='cancelled'))
+        return redirect(url_for('main.comprobante_pago', status='cancelled'))
     
     if not token_ws:
         print("Error: No se recibió token_ws")
-        return redirect(url_for('comprobante_pago', status='error'))
+        return redirect(url_for('main.comprobante_pago', status='error'))
     
     try:
         print("\nConsultando resultado de la transacción...")
@@ -752,20 +1242,28 @@ def retorno_webpay():
         response = webpay.commit_transaction(token_ws)
         print("Respuesta de commit:", response)
         
-        # Buscar la transacción en la base de datos
-        transaction = WebpayTransaction.query.filter_by(token_ws=token_ws).first()
-        if not transaction:
-            print("Error: Transacción no encontrada en la base de datos")
-            raise Exception('Transacción no encontrada')
-        
         # Verificar si la respuesta es un diccionario
         if isinstance(response, dict):
             response_code = response.get('response_code')
             amount = response.get('amount')
+            buy_order = response.get('buy_order')
         else:
             # Si es un objeto, intentar acceder a los atributos
             response_code = getattr(response, 'response_code', None)
             amount = getattr(response, 'amount', None)
+            buy_order = getattr(response, 'buy_order', None)
+        
+        # Buscar la transacción en la base de datos
+        transaction = WebpayTransaction.query.filter_by(token_ws=token_ws).first()
+        if not transaction and buy_order:
+            # El token no alcanzó a guardarse en iniciar_pago(): recuperar por buy_order
+            transaction = WebpayTransaction.query.filter_by(buy_order=buy_order, token_ws=None).first()
+            if transaction:
+                print(f"Transacción {buy_order} recuperada por orden de compra")
+                transaction.token_ws = token_ws
+        if not transaction:
+            print("Error: Transacción no encontrada en la base de datos")
+            raise Exception('Transacción no encontrada')
         
         print(f"Código de respuesta: {response_code}")
         print(f"Monto: {amount}")
@@ -776,26 +1274,31 @@ def retorno_webpay():
             transaction.status = 'completed'
             transaction.response_code = response_code
             transaction.amount = amount
-            transaction.order.status = 'completed'
+            # Condicional: la reconciliación pudo cerrar la orden y liberar su stock
+            order_status = complete_order(transaction.order_id)
+            if order_status != 'completed':
+                print(f"Orden {transaction.order_id} pagada sin stock disponible: queda en '{order_status}' para revisión manual")
             
             # Obtener el correo del usuario
             user = User.query.get(transaction.order.user_id)
             if user:
-                # Enviar comprobante por correo
-                enviar_comprobante(transaction.order, user.email)
+                # El comprobante queda en el outbox en la misma transacción que
+                # completa la orden; el worker 'outbox-worker' lo envía por SMTP
+                enqueue_receipt(transaction.order_id, user.email)
             
             status = 'success'
         else:
             print(f"Transacción fallida con código: {response_code}")
             transaction.status = 'failed'
             transaction.response_code = response_code
-            transaction.order.status = 'failed'
+            # Cerrar la orden y liberar el stock reservado en el checkout
+            close_pending_orders([transaction.order_id], 'failed')
             status = 'error'
         
         db.session.commit()
         print("Base de datos actualizada")
         
-        return redirect(url_for('comprobante_pago', status=status))
+        return redirect(url_for('main.comprobante_pago', status=status))
         
     except Exception as e:
         print(f"\n=== ERROR EN RETORNO WEBPAY ===")
@@ -804,15 +1307,15 @@ def retorno_webpay():
         import traceback
         print("Traceback completo:")
         print(traceback.format_exc())
-        return redirect(url_for('comprobante_pago', status='error'))
+        return redirect(url_for('main.comprobante_pago', status='error'))
 
-@app.route('/comprobante-pago')
+@main.route('/comprobante-pago')
 def comprobante_pago():
     status = request.args.get('status', 'error')
     return render_template('comprobante_pago.html', status=status, user=session.get('user'))
 
 # Rutas para el conversor de monedas
-@app.route('/conversor-moneda')
+@main.route('/conversor-moneda')
 def currency_converter_page():
     try:
         # Obtener información del usuario desde la sesión
@@ -822,9 +1325,9 @@ def currency_converter_page():
     except Exception as e:
         logger.error(f"Error al cargar el conversor de monedas: {str(e)}")
         flash('Error al cargar el conversor de monedas', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
-@app.route('/api/convert', methods=['POST'])
+@main.route('/api/convert', methods=['POST'])
 def convert_currency():
     try:
         # Verificar que la solicitud sea JSON
@@ -879,7 +1382,157 @@ def convert_currency():
         logger.error(f"Error general en /api/convert: {str(e)}")
         return jsonify({'error': 'Error interno del servidor'}), 500
 
-@app.route('/api/currencies', methods=['GET'])
+# Máximo de montos por solicitud en /api/convert/batch
+CONVERT_BATCH_MAX_ITEMS = 1000
+
+@main.route('/api/convert/batch', methods=['POST'])
+def convert_currency_batch():
+    """
+    Convertir una lista de montos en una sola solicitud
+    ---
+    tags:
+      - Conversor de Divisas
+    consumes:
+      - application/json
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - amounts
+            - currencies
+          properties:
+            amounts:
+              type: array
+              items:
+                type: number
+              description: Máximo 1000 montos por solicitud
+            currencies:
+              description: Una moneda por monto, o un solo código para todos
+              type: array
+              items:
+                type: string
+            direction:
+              type: string
+              enum: [to_clp, from_clp]
+              default: to_clp
+    responses:
+      200:
+        description: Montos convertidos (como texto decimal) y tasas usadas
+      400:
+        description: Datos inválidos; "index" indica el monto con problemas
+    """
+    data = request.get_json(silent=True)
+    amounts = data.get('amounts') if isinstance(data, dict) else None
+    if not isinstance(amounts, list) or not amounts:
+        return jsonify({'error': 'Se requiere una lista de montos'}), 400
+    if len(amounts) > CONVERT_BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Máximo {CONVERT_BATCH_MAX_ITEMS} montos por solicitud'}), 400
+
+    currencies = data.get('currencies')
+    if isinstance(currencies, str):
+        currencies = [currencies] * len(amounts)
+    if not isinstance(currencies, list) or len(currencies) != len(amounts):
+        return jsonify({'error': 'Se requiere una moneda por monto'}), 400
+
+    direction = data.get('direction', 'to_clp')
+    if direction not in ('to_clp', 'from_clp'):
+        return jsonify({'error': 'Dirección inválida'}), 400
+
+    parsed = []
+    for index, (amount, currency) in enumerate(zip(amounts, currencies)):
+        if currency not in CURRENCY_SERIES:
+            return jsonify({'error': f'Moneda no soportada: {currency}', 'index': index}), 400
+        try:
+            if isinstance(amount, bool):
+                raise InvalidOperation
+            value = Decimal(str(amount))
+            if not value.is_finite():
+                raise InvalidOperation
+        except InvalidOperation:
+            return jsonify({'error': 'El monto debe ser un número válido', 'index': index}), 400
+        if value <= 0:
+            return jsonify({'error': 'El monto debe ser mayor que 0', 'index': index}), 400
+        parsed.append(value)
+
+    try:
+        converted, rates, stale = currency_converter.convert_many(parsed, currencies, to_clp=direction == 'to_clp')
+    except ValueError as e:
+        logger.error(f"Error en la conversión por lote: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'direction': direction,
+        'date': datetime.now().strftime('%Y-%m-%d'),
+        'rates': {code: str(rate) for code, rate in rates.items()},
+        'stale': stale,
+        'results': [
+            {'amount': str(amount), 'currency': currency, 'converted': str(value)}
+            for amount, currency, value in zip(parsed, currencies, converted)
+        ]
+    })
+
+@main.route('/api/rates/<currency_code>', methods=['GET'])
+def get_rate_history(currency_code):
+    """
+    Histórico de tasas de una moneda entre dos fechas
+    ---
+    tags:
+      - Conversor de Divisas
+    parameters:
+      - name: currency_code
+        in: path
+        type: string
+        required: true
+        enum: [USD, EUR, UF, UTM]
+      - name: start
+        in: query
+        type: string
+        format: date
+        required: true
+      - name: end
+        in: query
+        type: string
+        format: date
+        description: Por defecto, hoy
+    responses:
+      200:
+        description: Tasas publicadas en el rango, ordenadas por fecha
+      400:
+        description: Moneda o rango inválido
+      502:
+        description: Error de la API del Banco Central al completar el rango
+      503:
+        description: API del Banco Central no disponible temporalmente
+    """
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date()
+        end_arg = request.args.get('end')
+        end = datetime.strptime(end_arg, '%Y-%m-%d').date() if end_arg else datetime.now().date()
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Se requieren fechas start y end con formato YYYY-MM-DD'}), 400
+
+    try:
+        rates = get_rate_range(currency_converter, currency_code.upper(), start, end)
+    except CircuitOpenError as e:
+        logger.warning(f"Histórico de {currency_code} no disponible: {str(e)}")
+        return jsonify({'error': str(e)}), 503
+    except RateSourceError as e:
+        logger.error(f"Error del Banco Central al obtener el histórico de {currency_code}: {str(e)}")
+        return jsonify({'error': 'No se pudo obtener el histórico desde el Banco Central'}), 502
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'currency': currency_code.upper(),
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'rates': [{'date': day.isoformat(), 'value': str(value)} for day, value in rates]
+    })
+
+@main.route('/api/currencies', methods=['GET'])
 def get_currencies():
     """
     Obtener las monedas disponibles para el conversor de divisas
@@ -902,13 +1555,28 @@ def get_currencies():
     except Exception as e:
         return jsonify({'error': 'Error interno del servidor'}), 500
 
+@main.route('/api/currencies/status', methods=['GET'])
+def get_currencies_status():
+    """
+    Frescura de las tasas de cambio precargadas
+    ---
+    tags:
+      - Conversor de Divisas
+    responses:
+      200:
+        description: Estado del último refresco de cada serie del Banco Central y del circuit breaker
+    """
+    status = rate_refresher.freshness()
+    status['circuit'] = currency_converter.breaker.status()
+    return jsonify(status)
+
 # Rutas para el contacto
-@app.route('/contacto')
+@main.route('/contacto')
 def contact_page():
     user = session.get('user') if 'user' in session else None
     return render_template('contact.html', user=user)
 
-@app.route('/api/contact', methods=['POST'])
+@main.route('/api/contact', methods=['POST'])
 def send_contact_email():
     """
     Enviar un mensaje de contacto por email
@@ -1000,13 +1668,19 @@ def send_contact_email():
         logger.error(f"Error al enviar correo de contacto: {str(e)}")
         return jsonify({'error': 'Error al enviar el mensaje'}), 500
 
-@app.route('/api/categories', methods=['GET'])
+@main.route('/api/categories', methods=['GET'])
 def get_categories():
     """
     Obtener todas las categorías
     ---
     tags:
       - Categorías
+    parameters:
+      - name: If-None-Match
+        in: header
+        type: string
+        required: false
+        description: ETag de una respuesta anterior; si no hubo cambios se responde 304
     responses:
       200:
         description: Lista de categorías
@@ -1014,17 +1688,43 @@ def get_categories():
           type: array
           items:
             $ref: '#/definitions/Category'
+      304:
+        description: Las categorías no cambiaron
     """
-    categories = Category.query.all()
-    result = []
-    for cat in categories:
-        result.append({
-            'id': cat.id,
-            'name': cat.name,
-            'description': cat.description,
-            'icon': cat.icon
-        })
-    return jsonify(result)
+    def load():
+        body = dumps([category_to_dict(cat) for cat in Category.query.all()])
+        # Las categorías no tienen updated_at: el ETag se calcula sobre su contenido
+        return {'etag': hashlib.sha1(body.encode()).hexdigest(), 'json': body}
+    result = catalog_cache.get_or_load('categories', load)
+    return catalog_json(result['etag'], lambda: result['json'])
+
+# Comandos de mantenimiento (flask <comando>)
+@main.cli.command('reconcile-payments')
+@click.option('--workers', default=8, show_default=True, help='Consultas simultáneas a Webpay')
+@click.option('--batch-size', default=200, show_default=True, help='Transacciones bloqueadas por lote')
+def reconcile_payments_command(workers, batch_size):
+    """Reconcilia con Webpay las órdenes que quedaron pendientes (programar con cron)"""
+    count = reconcile_orders_without_token()
+    print(f"Transacciones reconciliadas: {count}")
+    results = sweep_stale_transactions(webpay, batch_size=batch_size, max_workers=workers)
+    print(f"Transacciones consultadas en Webpay: {results}")
+    purged = purge_idempotency_keys()
+    print(f"Claves de idempotencia eliminadas: {purged}")
+
+@main.cli.command('catalog-invalidate')
+def catalog_invalidate_command():
+    """Invalida la caché del catálogo (tras cargar productos o categorías por script)"""
+    print(f"Versión del catálogo: {catalog_cache.bump()}")
+
+@main.cli.command('outbox-worker')
+@click.option('--once', is_flag=True, help='Procesa un solo lote y termina')
+@click.option('--interval', default=5, show_default=True, help='Segundos de espera cuando el outbox está vacío')
+def outbox_worker_command(once, interval):
+    """Envía los correos pendientes del outbox (comprobantes de pago)"""
+    run_worker(mail, interval=interval, once=once)
+
+# Aplicación por defecto (gunicorn app:app, flask run)
+app = create_app()
 
 # SIEMPRE DEBE ESTAR AL FINAL O EL PROGRAMA NO FUNCIONA
 if __name__ == '__main__':
@@ -78,10 +78,10 @@ def google_logged_in(blueprint, token):
     session["user_id"] = user.id
     
     flash('¡Inicio de sesión exitoso con Google!', 'success')
-    return redirect(url_for("home"))
+    return redirect(url_for("main.home"))
 
 @auth_bp.route("/logout")
 def logout():
     session.clear()
     flash('Has cerrado sesión exitosamente', 'success')
-    return redirect(url_for("home")) 
\ No newline at end of file
+    return redirect(url_for("main.home")) 
\ No newline at end of file
@@ -0,0 +1,226 @@
+"""
+Caché del catálogo (productos y categorías)
+Dos niveles: un LRU acotado en la memoria de cada worker delante de un nivel
+compartido, Redis si REDIS_URL está configurado o un archivo SQLite
+(CATALOG_CACHE_PATH) usado por todos los workers de la máquina y por los
+comandos de la CLI.
+
+Las claves llevan el número de versión del catálogo. Crear, modificar o
+eliminar un producto incrementa la versión en el nivel compartido y todas
+las entradas anteriores dejan de usarse en todos los workers a la vez.
+Si el nivel compartido no responde, la caché se omite (se consulta la base
+de datos) y se vuelve a intentar pasados CATALOG_STORE_RETRY segundos: un
+worker nunca queda con una versión del catálogo propia.
+"""
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import cached_property
+
+logger = logging.getLogger(__name__)
+
+# Entradas por worker y segundos de vida en el nivel compartido
+CATALOG_LRU_SIZE = int(os.getenv('CATALOG_LRU_SIZE', '512'))
+CATALOG_CACHE_TTL = int(os.getenv('CATALOG_CACHE_TTL', '3600'))
+# Segundos sin usar el nivel compartido tras un error antes de reintentar
+CATALOG_STORE_RETRY = int(os.getenv('CATALOG_STORE_RETRY', '30'))
+# Archivo SQLite por defecto: dentro de la aplicación y fuera de /tmp, para que
+# el servicio (PrivateTmp=yes) y la CLI usen el mismo archivo
+DEFAULT_CATALOG_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'catalog_cache.sqlite3')
+
+
+class SQLiteCatalogStore:
+    """Nivel compartido en un archivo SQLite; una conexión por operación (segura tras un fork)"""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS catalog_version (id INTEGER PRIMARY KEY, version INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 1)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS catalog_entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get_version(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT version FROM catalog_version WHERE id = 1").fetchone()[0]
+
+    def incr_version(self):
+        with self._connect() as conn:
+            conn.execute("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+            version = conn.execute("SELECT version FROM catalog_version WHERE id = 1").fetchone()[0]
+            # Las entradas de versiones anteriores ya no se leerán
+            conn.execute("DELETE FROM catalog_entries WHERE key NOT LIKE ?", (f"{version}:%",))
+        return version
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM catalog_entries WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._connect() as conn:
+            # Sin bump() las entradas vencidas se acumularían en el archivo
+            conn.execute("DELETE FROM catalog_entries WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "INSERT OR REPLACE INTO catalog_entries (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + ttl)
+            )
+
+
+class RedisCatalogStore:
+    """Nivel compartido en Redis, común a todas las instancias de la aplicación"""
+
+    PREFIX = 'ferremas:catalog'
+
+    def __init__(self, client):
+        self.client = client
+
+    def get_version(self):
+        return int(self.client.get(f"{self.PREFIX}:version") or 1)
+
+    def incr_version(self):
+        # La primera vez parte de 1, igual que get_version() sin la clave
+        self.client.set(f"{self.PREFIX}:version", 1, nx=True)
+        return self.client.incr(f"{self.PREFIX}:version")
+
+    def get(self, key):
+        return self.client.get(f"{self.PREFIX}:{key}")
+
+    def set(self, key, value, ttl):
+        self.client.set(f"{self.PREFIX}:{key}", value, ex=ttl)
+
+
+def create_catalog_store():
+    """
+    Usa Redis si REDIS_URL está configurado; si no, el archivo SQLite de
+    CATALOG_CACHE_PATH. Si Redis no responde no se cambia a SQLite: los
+    demás workers y la CLI seguirían invalidando Redis.
+    """
+    redis_url = os.getenv('REDIS_URL')
+    if redis_url:
+        import redis
+        logger.info("Caché del catálogo en Redis")
+        return RedisCatalogStore(redis.Redis.from_url(redis_url, socket_timeout=1))
+
+    path = os.path.abspath(os.getenv('CATALOG_CACHE_PATH', DEFAULT_CATALOG_CACHE_PATH))
+    temp_dir = os.path.abspath(tempfile.gettempdir())
+    if os.path.commonpath([path, temp_dir]) == temp_dir:
+        # Con PrivateTmp=yes cada servicio ve su propio /tmp y las invalidaciones se pierden
+        raise ValueError(f"CATALOG_CACHE_PATH debe estar fuera del directorio temporal: {path}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    logger.info(f"Caché del catálogo en {path}")
+    return SQLiteCatalogStore(path)
+
+
+class CatalogCache:
+    """
+    Caché de lectura del catálogo con invalidación por versión.
+
+    Cada lectura consulta la versión en el nivel compartido (Redis o SQLite,
+    nunca la base de datos), de modo que un bump() en un worker se respeta
+    de inmediato en los demás.
+    """
+
+    def __init__(self, store=None, max_entries=CATALOG_LRU_SIZE, ttl=CATALOG_CACHE_TTL, retry=CATALOG_STORE_RETRY):
+        if store is not None:
+            self.store = store
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.retry = retry
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._retry_at = 0.0
+        self._pending_bump = False
+
+    @cached_property
+    def store(self):
+        """Nivel compartido; se abre en el primer uso (la conexión a Redis puede tardar)"""
+        return create_catalog_store()
+
+    def version(self):
+        return self.store.get_version()
+
+    def _shared_store_failed(self, action, error):
+        """Omite el nivel compartido (y el LRU) hasta el próximo reintento"""
+        logger.warning(f"Error al {action} la caché del catálogo, se omite por {self.retry} s: {str(error)}")
+        self._retry_at = time.monotonic() + self.retry
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_load(self, name, loader):
+        """
+        Devuelve el valor cacheado de `name` para la versión actual del catálogo
+        o lo calcula con `loader()` (debe devolver datos serializables a JSON).
+        """
+        if time.monotonic() < self._retry_at:
+            return loader()
+        try:
+            if self._pending_bump:
+                # Un bump() falló mientras el nivel compartido no respondía
+                self.store.incr_version()
+                self._pending_bump = False
+            key = f"{self.version()}:{name}"
+        except Exception as e:
+            # Sin nivel compartido no hay forma segura de saber si el LRU está vigente
+            self._shared_store_failed('leer la versión de', e)
+            return loader()
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        try:
+            raw = self.store.get(key)
+        except Exception as e:
+            self._shared_store_failed('leer', e)
+            return loader()
+
+        if raw is not None:
+            value = json.loads(raw)
+        else:
+            value = loader()
+            try:
+                self.store.set(key, json.dumps(value), self.ttl)
+            except Exception as e:
+                self._shared_store_failed('escribir', e)
+                return value
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def bump(self):
+        """Invalida el catálogo en todos los workers; llamar después del commit"""
+        with self._lock:
+            self._entries.clear()
+        try:
+            version = self.store.incr_version()
+            self._pending_bump = False
+            logger.info(f"Versión del catálogo: {version}")
+            return version
+        except Exception as e:
+            # Se reintenta en cuanto el nivel compartido vuelva a responder
+            self._pending_bump = True
+            self._shared_store_failed('invalidar', e)
+            return None
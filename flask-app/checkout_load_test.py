@@ -0,0 +1,162 @@
+"""
+Prueba de carga del checkout completo
+Cada comprador virtual se registra, inicia sesión y repite el flujo
+/api/cart/add -> /iniciar-pago -> /retorno-webpay contra una instancia
+corriendo de la aplicación. Reporta throughput y percentiles de latencia.
+
+Usar siempre con una base de datos de pruebas y Webpay apuntando al mock:
+    python webpay_mock_server.py --latency-ms 300 &
+    WEBPAY_BASE_URL=http://localhost:8090 GUNICORN_WORKERS=3 gunicorn --config gunicorn.conf.py app:app &
+    python checkout_load_test.py --base-url http://localhost:5000 --users 30 --iterations 10
+"""
+import argparse
+import statistics
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import requests
+
+STEPS = ('add', 'iniciar_pago', 'retorno', 'checkout')
+
+
+def percentile(sorted_values, fraction):
+    """Percentil por rango más cercano sobre una lista ordenada"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def login_new_user(base_url, run_id, index):
+    """Registra un comprador nuevo y devuelve una sesión HTTP autenticada"""
+    http = requests.Session()
+    email = f"carga-{run_id}-{index}@ferremas.test"
+    password = 'carga123'
+    http.post(f"{base_url}/register", data={
+        'username': f"carga-{run_id}-{index}", 'email': email, 'password': password
+    }, allow_redirects=False)
+    response = http.post(f"{base_url}/login", data={'email': email, 'password': password},
+                         allow_redirects=False)
+    # Un login exitoso redirige al home; uno fallido vuelve a mostrar el formulario
+    if response.status_code != 302:
+        raise RuntimeError(f"No se pudo iniciar sesión con {email}")
+    return http
+
+
+def checkout_once(http, base_url, product_id, timings):
+    """
+    Ejecuta un checkout completo y registra la duración de cada paso.
+
+    Returns:
+        str | None: nombre del paso que falló, o None si el pago terminó bien
+    """
+    started = time.perf_counter()
+
+    step_started = time.perf_counter()
+    response = http.post(f"{base_url}/api/cart/add", json={'product_id': product_id, 'quantity': 1})
+    timings['add'].append(time.perf_counter() - step_started)
+    if response.status_code != 201:
+        return 'add'
+
+    step_started = time.perf_counter()
+    response = http.post(f"{base_url}/iniciar-pago", headers={'Idempotency-Key': uuid.uuid4().hex})
+    timings['iniciar_pago'].append(time.perf_counter() - step_started)
+    if response.status_code != 200:
+        return 'iniciar_pago'
+    token = response.json()['token']
+
+    # El comprador "paga" en Webpay y vuelve al comercio con el token
+    step_started = time.perf_counter()
+    response = http.post(f"{base_url}/retorno-webpay", data={'token_ws': token}, allow_redirects=False)
+    timings['retorno'].append(time.perf_counter() - step_started)
+    if 'status=success' not in response.headers.get('Location', ''):
+        return 'retorno'
+
+    timings['checkout'].append(time.perf_counter() - started)
+    return None
+
+
+def run_load_test(base_url, users=10, iterations=5, product_id=None):
+    """
+    Lanza `users` compradores concurrentes que hacen `iterations` checkouts cada uno.
+
+    Returns:
+        dict: throughput de checkouts y percentiles (ms) por paso
+    """
+    base_url = base_url.rstrip('/')
+    if product_id is None:
+        items = requests.get(f"{base_url}/api/products", params={'limit': 1}).json()['items']
+        if not items:
+            raise RuntimeError("No hay productos en el catálogo")
+        product_id = items[0]['id']
+
+    run_id = uuid.uuid4().hex[:8]
+    sessions = [login_new_user(base_url, run_id, i) for i in range(users)]
+
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(users)
+
+    def shopper(http):
+        own_timings = defaultdict(list)
+        own_errors = defaultdict(int)
+        start_barrier.wait()
+        for _ in range(iterations):
+            try:
+                failed_step = checkout_once(http, base_url, product_id, own_timings)
+            except requests.RequestException:
+                failed_step = 'conexion'
+            if failed_step:
+                own_errors[failed_step] += 1
+        with lock:
+            for step, values in own_timings.items():
+                timings[step].extend(values)
+            for step, count in own_errors.items():
+                errors[step] += count
+
+    threads = [threading.Thread(target=shopper, args=(http,)) for http in sessions]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stats = {
+        'users': users,
+        'attempts': users * iterations,
+        'completed': len(timings['checkout']),
+        'errors': dict(errors),
+        'elapsed_s': round(elapsed, 3),
+        'checkouts_per_s': round(len(timings['checkout']) / elapsed, 2),
+    }
+    for step in STEPS:
+        values = sorted(value * 1000 for value in timings[step])
+        stats[step] = {
+            'count': len(values),
+            'p50_ms': round(statistics.median(values), 1) if values else 0.0,
+            'p95_ms': round(percentile(values, 0.95), 1),
+            'p99_ms': round(percentile(values, 0.99), 1),
+            'max_ms': round(values[-1], 1) if values else 0.0,
+        }
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga del checkout')
+    parser.add_argument('--base-url', default='http://localhost:5000')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--product-id', type=int)
+    args = parser.parse_args()
+
+    stats = run_load_test(args.base_url, args.users, args.iterations, args.product_id)
+    for key, value in stats.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Circuit breaker para servicios externos
+Tras varios errores seguidos deja de llamar al servicio (falla de inmediato)
+y verifica en segundo plano cuándo vuelve a responder.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(ValueError):
+    """El servicio está marcado como caído; no se intentó la llamada"""
+
+
+class CircuitBreaker:
+    """
+    Estados:
+        closed: las llamadas pasan; se cuentan los errores consecutivos
+        open:   las llamadas fallan de inmediato con CircuitOpenError mientras
+                un hilo ejecuta `probe` cada `reset_timeout` segundos (con
+                espera exponencial hasta `max_reset_timeout`) hasta que funcione
+    """
+
+    def __init__(self, name, probe, failure_threshold=3, reset_timeout=30,
+                 max_reset_timeout=300, counted_exceptions=(Exception,)):
+        self.name = name
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.counted_exceptions = counted_exceptions
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+        self._probe_thread = None
+
+    def call(self, func, *args, **kwargs):
+        if self.state == 'open':
+            self._ensure_probe()
+            raise CircuitOpenError(f"{self.name} no disponible temporalmente")
+        try:
+            result = func(*args, **kwargs)
+        except self.counted_exceptions:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def record_success(self):
+        if self.failures:
+            with self._lock:
+                self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'closed' and self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.time()
+                logger.error(f"Circuito de {self.name} abierto tras {self.failures} errores seguidos")
+        if self.state == 'open':
+            self._ensure_probe()
+
+    def _ensure_probe(self):
+        # También recrea el hilo si se perdió (por ejemplo, tras un fork)
+        with self._lock:
+            if self._probe_thread is not None and self._probe_thread.is_alive():
+                return
+            self._probe_thread = threading.Thread(
+                target=self._probe_loop, name=f"{self.name}-probe", daemon=True
+            )
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        delay = self.reset_timeout
+        while True:
+            time.sleep(delay)
+            try:
+                self.probe()
+            except Exception as e:
+                logger.warning(f"{self.name} sigue sin responder: {str(e)}")
+                delay = min(delay * 2, self.max_reset_timeout)
+                continue
+            with self._lock:
+                self.state = 'closed'
+                self.failures = 0
+                self.opened_at = None
+            logger.info(f"Circuito de {self.name} cerrado: el servicio respondió")
+            return
+
+    def status(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'opened_at': self.opened_at,
+        }
@@ -1,10 +1,17 @@
 import requests
 from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
 import os
 from dotenv import load_dotenv
-from functools import lru_cache
+from flask import has_app_context
+from functools import cached_property
 import json
 import logging
+import threading
+import time
+
+from circuit_breaker import CircuitBreaker
+from rate_cache import business_day, create_rate_cache, previous_business_day
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -17,6 +24,16 @@ load_dotenv()
 BDE_EMAIL = os.getenv('BDE_EMAIL')
 BDE_PASSWORD = os.getenv('BDE_PASSWORD')
 BASE_URL = "https://si3.bcentral.cl/SieteRestWS/SieteRestWS.ashx"
+# Segundos tras los cuales la tasa del día hábil en curso se revalida
+RATE_CACHE_TTL = int(os.getenv('RATE_CACHE_TTL', '3600'))
+
+# Circuit breaker: errores seguidos antes de abrir y espera inicial antes de probar de nuevo
+BCCH_BREAKER_FAILURES = int(os.getenv('BCCH_BREAKER_FAILURES', '3'))
+BCCH_BREAKER_RESET_SECONDS = int(os.getenv('BCCH_BREAKER_RESET_SECONDS', '30'))
+
+# Precisión de los montos convertidos en lote
+CLP_QUANTUM = Decimal('0.01')
+FOREIGN_QUANTUM = Decimal('0.0001')
 
 # Códigos de series para diferentes monedas
 CURRENCY_SERIES = {
@@ -30,15 +47,29 @@ class CurrencyConverter:
     def __init__(self):
         try:
             self.session = requests.Session()
+            # Copia en memoria de las tasas ya vistas por este proceso
+            self._memory = {}
+            # Con la API caída, falla de inmediato en vez de bloquear un worker 10 segundos
+            self.breaker = CircuitBreaker(
+                'API del Banco Central',
+                probe=self._probe,
+                failure_threshold=BCCH_BREAKER_FAILURES,
+                reset_timeout=BCCH_BREAKER_RESET_SECONDS,
+                counted_exceptions=(requests.RequestException,)
+            )
             if not BDE_EMAIL or not BDE_PASSWORD:
-                logger.error("Credenciales de la API del Banco Central no configuradas")
-                raise ValueError("Credenciales de la API del Banco Central no configuradas")
+                # No impide iniciar la app: las conversiones fallarán al consultar la API
+                logger.warning("Credenciales de la API del Banco Central no configuradas")
             logger.info("CurrencyConverter inicializado correctamente")
         except Exception as e:
             logger.error(f"Error al inicializar CurrencyConverter: {str(e)}")
             raise
 
-    @lru_cache(maxsize=32)
+    @cached_property
+    def cache(self):
+        """Caché compartida; se abre en el primer uso (la conexión a Redis puede tardar)"""
+        return create_rate_cache()
+
     def get_exchange_rate(self, currency_code, date=None):
         """
         Obtiene la tasa de cambio para una moneda específica.
@@ -53,20 +84,212 @@ class CurrencyConverter:
         Raises:
             ValueError: Si la moneda no está soportada o hay un error en la API
         """
-        try:
-            logger.info(f"Obteniendo tasa de cambio para {currency_code}")
+        return self.get_rate_info(currency_code, date)[0]
+
+    def get_rate_info(self, currency_code, date=None):
+        """
+        Obtiene la tasa de cambio e indica si es una tasa desactualizada.
+        
+        Las tasas se cachean por (serie, día hábil) en una caché compartida
+        entre workers. Pasado RATE_CACHE_TTL, la tasa del día en curso se
+        sigue sirviendo mientras un hilo la revalida en segundo plano
+        (stale-while-revalidate); solo una caché vacía bloquea la respuesta.
+        Si la API no responde (o el circuit breaker está abierto), se sirve
+        la última tasa conocida marcada como desactualizada.
+        
+        Returns:
+            tuple: (tasa, stale) donde stale es True si la tasa no corresponde
+            al día hábil solicitado
             
-            if currency_code not in CURRENCY_SERIES:
-                logger.error(f"Moneda no soportada: {currency_code}")
-                raise ValueError(f"Moneda no soportada: {currency_code}")
+        Raises:
+            ValueError: Si la moneda no está soportada o no hay ninguna tasa disponible
+        """
+        logger.info(f"Obteniendo tasa de cambio para {currency_code}")
+        
+        if currency_code not in CURRENCY_SERIES:
+            logger.error(f"Moneda no soportada: {currency_code}")
+            raise ValueError(f"Moneda no soportada: {currency_code}")
+
+        series = CURRENCY_SERIES[currency_code]
+        today = business_day(datetime.now())
+        day = business_day(date) if date is not None else today
+
+        entry = self._memory.get((series, day))
+        if entry is None or (day >= today and time.time() - entry[1] > RATE_CACHE_TTL):
+            # Otro worker (o el refresher) pudo haber guardado una tasa más nueva
+            shared = self._cache_get(series, day)
+            if shared is not None and (entry is None or shared[1] > entry[1]):
+                entry = self._memory[(series, day)] = tuple(shared)
+        if entry is not None:
+            value, fetched_at = entry
+            # Las tasas de días pasados ya no cambian; solo se revalida el día en curso
+            if day >= today and time.time() - fetched_at > RATE_CACHE_TTL:
+                self._revalidate_async(currency_code, day)
+            return value, False
+
+        if date is None:
+            # Cambio de día: servir la tasa del día hábil anterior mientras se obtiene la nueva
+            previous = (self._memory.get((series, previous_business_day(day)))
+                        or self._cache_get(series, previous_business_day(day)))
+            if previous is not None:
+                self._revalidate_async(currency_code, day)
+                return previous[0], True
+
+        if date is not None and has_app_context():
+            # Fechas pasadas: desde el histórico persistente (solo se descargan las que faltan)
+            from rate_store import get_historical_rate
+            value = get_historical_rate(self, currency_code, date)
+        else:
+            try:
+                value = self._fetch_rate(currency_code, date)
+            except ValueError:
+                # Modo degradado: la última tasa conocida es mejor que no convertir
+                last_known = self._last_known_rate(series) if date is None else None
+                if last_known is None:
+                    raise
+                logger.warning(f"API no disponible: usando la última tasa conocida de {currency_code}")
+                return last_known, True
+        self.store_rate(series, day, value)
+        return value, False
+
+    def _last_known_rate(self, series):
+        """Tasa más reciente guardada para la serie, de cualquier día"""
+        days = [day for (entry_series, day) in list(self._memory) if entry_series == series]
+        if days:
+            return self._memory[(series, max(days))][0]
+        try:
+            latest = self.cache.latest(series)
+        except Exception as e:
+            logger.warning(f"Error al leer la caché de tasas: {str(e)}")
+            return None
+        return latest[0] if latest else None
+
+    def load_cached_rates(self):
+        """Copia a memoria las tasas del día (o del día hábil anterior) de la caché compartida"""
+        today = business_day(datetime.now())
+        loaded = 0
+        for series in CURRENCY_SERIES.values():
+            for day in (today, previous_business_day(today)):
+                entry = self._cache_get(series, day)
+                if entry is not None:
+                    self._memory[(series, day)] = tuple(entry)
+                    loaded += 1
+                    break
+        return loaded
+
+    def store_rate(self, series, day, value):
+        """Guarda una tasa recién obtenida en memoria y en la caché compartida"""
+        self._memory[(series, day)] = (value, time.time())
+        self._cache_set(series, day, value)
+
+    def _cache_get(self, series, day):
+        # Un problema con la caché nunca debe impedir la conversión
+        try:
+            return self.cache.get(series, day)
+        except Exception as e:
+            logger.warning(f"Error al leer la caché de tasas: {str(e)}")
+            return None
+
+    def _cache_set(self, series, day, value):
+        try:
+            self.cache.set(series, day, value)
+        except Exception as e:
+            logger.warning(f"Error al escribir la caché de tasas: {str(e)}")
+
+    def _revalidate_async(self, currency_code, day):
+        """Refresca la tasa en un hilo; el lock evita que varios workers consulten a la vez"""
+        lock_name = f"{CURRENCY_SERIES[currency_code]}:{day.isoformat()}"
+        try:
+            if not self.cache.acquire(lock_name):
+                return
+        except Exception as e:
+            logger.warning(f"Error al tomar el lock de la caché de tasas: {str(e)}")
+            return
+
+        def refresh():
+            try:
+                self._refresh_locked(currency_code, day, lock_name)
+            except ValueError as e:
+                logger.warning(f"No se pudo revalidar la tasa de {currency_code}: {str(e)}")
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def revalidate_rate(self, currency_code, fresh_after=None):
+        """
+        Refresca la tasa del día hábil en curso consultando la API una sola
+        vez entre todos los workers: si la caché compartida ya tiene una tasa
+        obtenida después de `fresh_after` (por defecto, dentro de
+        RATE_CACHE_TTL) se usa esa, y la API solo se consulta con el lock
+        `serie:día` tomado.
+
+        Returns:
+            tuple: (tasa, consultada) donde consultada es True si se llamó a
+            la API, o None si otro worker la está consultando o no se pudo
+            tomar el lock
+
+        Raises:
+            ValueError: Si la consulta a la API falla
+        """
+        series = CURRENCY_SERIES[currency_code]
+        day = business_day(datetime.now())
+        if fresh_after is None:
+            fresh_after = time.time() - RATE_CACHE_TTL
 
-            # Si no se especifica fecha, usar la fecha actual
-            if date is None:
-                date = datetime.now()
+        def fresh_entry():
+            shared = self._cache_get(series, day)
+            if shared is not None and shared[1] >= fresh_after:
+                self._memory[(series, day)] = tuple(shared)
+                return shared[0], False
+            return None
 
-            # Formatear fechas para la API
-            end_date = date.strftime('%Y-%m-%d')
-            start_date = (date - timedelta(days=5)).strftime('%Y-%m-%d')
+        entry = fresh_entry()
+        if entry is not None:
+            return entry
+
+        lock_name = f"{series}:{day.isoformat()}"
+        try:
+            acquired = self.cache.acquire(lock_name)
+        except Exception as e:
+            logger.warning(f"Error al tomar el lock de la caché de tasas: {str(e)}")
+            return None
+        if not acquired:
+            # Otro worker está consultando la API; puede que ya haya terminado
+            return fresh_entry()
+
+        # Quien soltó el lock recién pudo haber guardado la tasa
+        entry = fresh_entry()
+        if entry is not None:
+            try:
+                self.cache.release(lock_name)
+            except Exception:
+                pass
+            return entry
+        return self._refresh_locked(currency_code, day, lock_name), True
+
+    def _refresh_locked(self, currency_code, day, lock_name):
+        """Consulta la API con el lock `serie:día` tomado y lo libera al terminar"""
+        try:
+            value = self._fetch_rate(currency_code)
+            self.store_rate(CURRENCY_SERIES[currency_code], day, value)
+            return value
+        finally:
+            try:
+                self.cache.release(lock_name)
+            except Exception:
+                pass
+
+    def _fetch_observations(self, currency_code, start_date, end_date):
+        """
+        Descarga las observaciones de una serie entre dos fechas (inclusive).
+        
+        Returns:
+            list: observaciones tal como las entrega la API
+            (dicts con indexDateString, value y statusCode)
+        """
+        try:
+            if not BDE_EMAIL or not BDE_PASSWORD:
+                logger.error("Credenciales de la API del Banco Central no configuradas")
+                raise ValueError("Credenciales de la API del Banco Central no configuradas")
 
             # Construir los parámetros de la API
             params = {
@@ -74,14 +297,14 @@ class CurrencyConverter:
                 'pass': BDE_PASSWORD,
                 'function': 'GetSeries',
                 'timeseries': CURRENCY_SERIES[currency_code],
-                'firstdate': start_date,
-                'lastdate': end_date
+                'firstdate': start_date.strftime('%Y-%m-%d'),
+                'lastdate': end_date.strftime('%Y-%m-%d')
             }
 
             logger.info(f"Realizando petición a la API con parámetros: {params}")
 
-            # Realizar la solicitud a la API
-            response = self.session.get(BASE_URL, params=params, timeout=10)
+            # Realizar la solicitud a la API (a través del circuit breaker)
+            response = self.breaker.call(self._request, params)
             
             # Verificar errores de autenticación
             if response.status_code == 401:
@@ -105,36 +328,64 @@ class CurrencyConverter:
                 logger.error(f"No hay datos disponibles para {currency_code}")
                 raise ValueError(f"No hay datos disponibles para {currency_code}")
 
-            # Obtener el valor más reciente
-            series = data['Series']
-            if not series['Obs']:
-                logger.error(f"No hay observaciones para {currency_code}")
-                raise ValueError(f"No hay observaciones para {currency_code}")
-
-            # Filtrar observaciones válidas (statusCode = 'OK')
-            valid_observations = [obs for obs in series['Obs'] if obs['statusCode'] == 'OK']
-            
-            if not valid_observations:
-                logger.error(f"No hay observaciones válidas para {currency_code}")
-                raise ValueError(f"No hay observaciones válidas para {currency_code}")
-
-            # Tomar el valor más reciente
-            try:
-                latest_value = float(valid_observations[-1]['value'])
-            except (KeyError, ValueError, IndexError) as e:
-                logger.error(f"Error al obtener el valor más reciente: {str(e)}")
-                raise ValueError("Error al procesar el valor de la tasa de cambio")
-
-            logger.info(f"Tasa de cambio obtenida para {currency_code}: {latest_value}")
-            return latest_value
+            return data['Series'].get('Obs') or []
 
         except requests.RequestException as e:
             logger.error(f"Error de conexión con la API: {str(e)}")
             raise ValueError(f"Error al conectar con la API del Banco Central: {str(e)}")
+        except ValueError:
+            raise
         except Exception as e:
             logger.error(f"Error inesperado: {str(e)}")
             raise ValueError(f"Error inesperado: {str(e)}")
 
+    def _request(self, params):
+        """GET a la API; los errores 5xx cuentan como fallas para el circuit breaker"""
+        response = self.session.get(BASE_URL, params=params, timeout=10)
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+    def _probe(self):
+        """Consulta liviana usada por el circuit breaker para detectar que la API volvió"""
+        today = datetime.now()
+        self._request({
+            'user': BDE_EMAIL,
+            'pass': BDE_PASSWORD,
+            'function': 'GetSeries',
+            'timeseries': CURRENCY_SERIES['USD'],
+            'firstdate': (today - timedelta(days=5)).strftime('%Y-%m-%d'),
+            'lastdate': today.strftime('%Y-%m-%d')
+        }).raise_for_status()
+
+    def _fetch_rate(self, currency_code, date=None):
+        """Consulta la tasa de cambio en la API del Banco Central (sin caché)"""
+        # Si no se especifica fecha, usar la fecha actual
+        if date is None:
+            date = datetime.now()
+
+        observations = self._fetch_observations(currency_code, date - timedelta(days=5), date)
+        if not observations:
+            logger.error(f"No hay observaciones para {currency_code}")
+            raise ValueError(f"No hay observaciones para {currency_code}")
+
+        # Filtrar observaciones válidas (statusCode = 'OK')
+        valid_observations = [obs for obs in observations if obs.get('statusCode') == 'OK']
+        
+        if not valid_observations:
+            logger.error(f"No hay observaciones válidas para {currency_code}")
+            raise ValueError(f"No hay observaciones válidas para {currency_code}")
+
+        # Tomar el valor más reciente
+        try:
+            latest_value = float(valid_observations[-1]['value'])
+        except (KeyError, ValueError, IndexError) as e:
+            logger.error(f"Error al obtener el valor más reciente: {str(e)}")
+            raise ValueError("Error al procesar el valor de la tasa de cambio")
+
+        logger.info(f"Tasa de cambio obtenida para {currency_code}: {latest_value}")
+        return latest_value
+
     def convert_to_clp(self, amount, from_currency):
         """
         Convierte un monto desde una moneda extranjera a CLP.
@@ -165,7 +416,7 @@ class CurrencyConverter:
 
             # Obtener la tasa de cambio
             try:
-                rate = self.get_exchange_rate(from_currency)
+                rate, stale = self.get_rate_info(from_currency)
             except ValueError as e:
                 logger.error(f"Error al obtener tasa de cambio: {str(e)}")
                 raise ValueError(f"Error al obtener tasa de cambio: {str(e)}")
@@ -178,7 +429,8 @@ class CurrencyConverter:
                 "rate": rate,
                 "currency": from_currency,
                 "original_amount": amount,
-                "date": datetime.now().strftime('%Y-%m-%d')
+                "date": datetime.now().strftime('%Y-%m-%d'),
+                "stale": stale
             }
             
             logger.info(f"Conversión exitosa: {result}")
@@ -191,6 +443,41 @@ class CurrencyConverter:
             logger.error(f"Error inesperado en la conversión: {str(e)}")
             raise ValueError(f"Error inesperado: {str(e)}")
 
+    def convert_many(self, amounts, currencies, to_clp=True):
+        """
+        Convierte una lista de montos en una sola pasada.
+        
+        Cada moneda distinta se resuelve una sola vez (desde memoria o la
+        caché compartida) y todos los cálculos se hacen con Decimal.
+        
+        Args:
+            amounts (list[Decimal]): Montos a convertir
+            currencies (list[str]): Código de moneda de cada monto
+            to_clp (bool): True convierte a CLP; False convierte montos en CLP a la moneda
+            
+        Returns:
+            tuple: (lista de montos convertidos, dict de tasas usadas por moneda,
+            True si alguna tasa está desactualizada)
+            
+        Raises:
+            ValueError: Si alguna tasa no se puede obtener
+        """
+        rates = {}
+        stale = False
+        for currency_code in currencies:
+            if currency_code not in rates:
+                rate, rate_stale = self.get_rate_info(currency_code)
+                rates[currency_code] = Decimal(str(rate))
+                stale = stale or rate_stale
+
+        if to_clp:
+            converted = [(amount * rates[code]).quantize(CLP_QUANTUM, ROUND_HALF_UP)
+                         for amount, code in zip(amounts, currencies)]
+        else:
+            converted = [(amount / rates[code]).quantize(FOREIGN_QUANTUM, ROUND_HALF_UP)
+                         for amount, code in zip(amounts, currencies)]
+        return converted, rates, stale
+
     def get_available_currencies(self):
         """
         Retorna la lista de monedas disponibles para conversión.
@@ -0,0 +1,121 @@
+"""
+Outbox de correos electrónicos
+Los correos se registran en la tabla email_outbox dentro de la misma transacción
+que los origina; un worker en segundo plano los envía por SMTP con reintentos,
+de modo que ninguna respuesta HTTP espera al servidor de correo.
+"""
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import render_template
+from flask_mail import Message
+
+from extensions import db
+from models import EmailOutbox, Order
+
+logger = logging.getLogger(__name__)
+
+# Configuración de reintentos
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+BATCH_SIZE = 50
+
+
+def enqueue_receipt(order_id, recipient):
+    """Agrega al outbox el comprobante de pago de una orden (sin hacer commit)"""
+    db.session.add(EmailOutbox(kind='comprobante', order_id=order_id, recipient=recipient))
+
+
+def build_message(entry):
+    """Construye el mensaje de Flask-Mail correspondiente a una fila del outbox"""
+    if entry.kind == 'comprobante':
+        order = db.session.get(Order, entry.order_id)
+        if order is None:
+            raise ValueError(f"Orden {entry.order_id} no encontrada")
+        msg = Message('Comprobante de Pago - Ferremas', recipients=[entry.recipient])
+        msg.html = render_template(
+            'email/comprobante.html',
+            order=order,
+            current_year=datetime.now().year
+        )
+        return msg
+    raise ValueError(f"Tipo de correo no soportado: {entry.kind}")
+
+
+def backoff_seconds(attempts):
+    """Espera exponencial entre reintentos: 30s, 60s, 120s... hasta 1 hora"""
+    return min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+
+
+def _schedule_retry(entry, error, now):
+    entry.attempts += 1
+    entry.last_error = str(error)[:1000]
+    if entry.attempts >= MAX_ATTEMPTS:
+        entry.status = 'failed'
+        logger.error(f"Correo {entry.id} descartado tras {entry.attempts} intentos: {error}")
+    else:
+        entry.next_attempt_at = now + timedelta(seconds=backoff_seconds(entry.attempts))
+        logger.warning(f"Correo {entry.id} falló (intento {entry.attempts}), se reintentará: {error}")
+
+
+def drain_outbox(mail, batch_size=BATCH_SIZE):
+    """
+    Envía un lote de correos pendientes reutilizando una única conexión SMTP.
+
+    Las filas se toman con FOR UPDATE SKIP LOCKED para que varios workers
+    puedan drenar el outbox en paralelo sin enviar dos veces el mismo correo.
+
+    Returns:
+        tuple: (enviados, fallidos) en este lote
+    """
+    now = datetime.now(timezone.utc)
+    entries = (EmailOutbox.query
+               .filter(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now)
+               .order_by(EmailOutbox.id)
+               .limit(batch_size)
+               .with_for_update(skip_locked=True)
+               .all())
+    if not entries:
+        db.session.commit()
+        return 0, 0
+
+    sent = failed = 0
+    pending = list(entries)
+    try:
+        with mail.connect() as connection:
+            while pending:
+                entry = pending.pop(0)
+                try:
+                    connection.send(build_message(entry))
+                    entry.status = 'sent'
+                    entry.sent_at = now
+                    sent += 1
+                except Exception as e:
+                    _schedule_retry(entry, e, now)
+                    failed += 1
+    except Exception as e:
+        # No se pudo abrir (o se cayó) la conexión: reintentar lo que quedó sin procesar
+        for entry in pending:
+            _schedule_retry(entry, e, now)
+            failed += 1
+
+    db.session.commit()
+    logger.info(f"Outbox: {sent} correos enviados, {failed} fallidos")
+    return sent, failed
+
+
+def run_worker(mail, interval=5, once=False):
+    """Drena el outbox en un ciclo; duerme `interval` segundos cuando está vacío"""
+    while True:
+        try:
+            sent, failed = drain_outbox(mail)
+        except Exception as e:
+            logger.error(f"Error al drenar el outbox: {str(e)}")
+            db.session.rollback()
+            sent = failed = 0
+        if once:
+            return
+        if sent + failed == 0:
+            time.sleep(interval)
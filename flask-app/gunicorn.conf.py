@@ -0,0 +1,30 @@
+"""
+Configuración de gunicorn para FERREMAS
+gunicorn la lee automáticamente al iniciarse desde flask-app/:
+
+    gunicorn app:app
+
+La aplicación se carga una sola vez en el proceso maestro (preload) y los
+workers la heredan por copy-on-write: menos memoria y reinicios más rápidos.
+Con preload, `kill -HUP` reinicia los workers pero no recarga el código;
+para desplegar una versión nueva hay que reiniciar el servicio.
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '3'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+def when_ready(server):
+    # Proceso maestro, antes del fork: las plantillas compiladas quedan compartidas
+    if preload_app:
+        from app import app, warm_templates
+        server.log.info(f"Plantillas precompiladas: {warm_templates(app)}")
+
+
+def post_fork(server, worker):
+    # Cada worker descarta las conexiones heredadas y precalienta sus recursos
+    from app import app, init_worker
+    init_worker(app)
@@ -0,0 +1,115 @@
+"""
+Claves de idempotencia (cabecera Idempotency-Key)
+Una solicitud repetida con la misma clave recibe la respuesta guardada sin
+volver a ejecutar la vista: no se crean filas ni se llama a servicios externos.
+"""
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from flask import Response, jsonify, make_response, request, session
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 100
+# Horas que se conserva una respuesta para repetirla
+IDEMPOTENCY_KEY_TTL_HOURS = 24
+# Segundos tras los cuales una reserva sin respuesta se da por abandonada (el
+# worker murió o gunicorn lo reinició); por defecto, tres veces su timeout
+IDEMPOTENCY_IN_FLIGHT_SECONDS = int(os.getenv(
+    'IDEMPOTENCY_IN_FLIGHT_SECONDS', str(3 * int(os.getenv('GUNICORN_TIMEOUT', '120')))))
+
+
+def idempotent(scope):
+    """
+    Decorador para rutas POST de usuarios autenticados. Sin cabecera
+    Idempotency-Key la vista se ejecuta normalmente.
+
+    - Clave nueva: se registra y se ejecuta la vista. Si responde 200 se
+      guarda la respuesta; si falla la clave se libera para poder reintentar.
+    - Clave con respuesta guardada: se devuelve esa misma respuesta.
+    - Clave cuya solicitud original sigue en curso: 409. Pasados
+      IDEMPOTENCY_IN_FLIGHT_SECONDS sin respuesta, la reserva se considera
+      abandonada y la toma la siguiente solicitud con esa clave.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            user_id = session.get('user_id')
+            if not key or not user_id:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({'error': f'{IDEMPOTENCY_HEADER} demasiado larga'}), 400
+
+            stored = IdempotencyKey.query.filter_by(user_id=user_id, scope=scope, key=key).first()
+            if stored is None:
+                record = IdempotencyKey(user_id=user_id, scope=scope, key=key)
+                db.session.add(record)
+                try:
+                    db.session.commit()
+                    record_id = record.id
+                except IntegrityError:
+                    # Otra solicitud con la misma clave se registró primero
+                    db.session.rollback()
+                    stored = IdempotencyKey.query.filter_by(user_id=user_id, scope=scope, key=key).first()
+
+            if stored is not None and stored.response_body is None and take_over_reservation(stored.id):
+                logger.warning(f"Reserva abandonada para {scope} con clave {key}: se vuelve a ejecutar")
+                record_id, stored = stored.id, None
+
+            if stored is not None:
+                if stored.response_body is None:
+                    return jsonify({'error': 'Solicitud en proceso'}), 409
+                logger.info(f"Respuesta repetida para {scope} con clave {key}")
+                return Response(stored.response_body, status=stored.status_code,
+                                mimetype='application/json')
+
+            response = make_response(view(*args, **kwargs))
+            try:
+                if response.status_code == 200:
+                    IdempotencyKey.query.filter_by(id=record_id).update({
+                        'status_code': response.status_code,
+                        'response_body': response.get_data(as_text=True)
+                    })
+                else:
+                    IdempotencyKey.query.filter_by(id=record_id).delete()
+                db.session.commit()
+            except Exception as e:
+                logger.error(f"No se pudo registrar la clave de idempotencia {key}: {str(e)}")
+                db.session.rollback()
+            return response
+        return wrapper
+    return decorator
+
+
+def take_over_reservation(record_id, max_age_seconds=IDEMPOTENCY_IN_FLIGHT_SECONDS):
+    """
+    Renueva una reserva sin respuesta más antigua que `max_age_seconds` con
+    un UPDATE condicional: si dos solicitudes compiten, solo una la toma.
+
+    Returns:
+        bool: True si la reserva quedó a cargo de esta solicitud
+    """
+    now = datetime.now(timezone.utc)
+    taken = (IdempotencyKey.query
+             .filter(IdempotencyKey.id == record_id,
+                     IdempotencyKey.response_body.is_(None),
+                     IdempotencyKey.created_at < now - timedelta(seconds=max_age_seconds))
+             .update({'created_at': now}, synchronize_session=False))
+    db.session.commit()
+    return taken == 1
+
+
+def purge_idempotency_keys(max_age_hours=IDEMPOTENCY_KEY_TTL_HOURS):
+    """Elimina las claves más antiguas que `max_age_hours`"""
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=max_age_hours)
+    deleted = IdempotencyKey.query.filter(IdempotencyKey.created_at < cutoff).delete()
+    db.session.commit()
+    return deleted
@@ -1,4 +1,4 @@
-from app import app, db
+from app import app, catalog_cache, db
 from models import Category
 
 def init_categories():
@@ -56,6 +56,7 @@ def init_categories():
         
         # Guardar cambios
         db.session.commit()
+        catalog_cache.bump()
         print("Categorías inicializadas correctamente")
 
 if __name__ == '__main__':
@@ -1,4 +1,4 @@
-from app import app, db
+from app import app, catalog_cache, db
 from models import Product
 
 def init_db():
@@ -24,6 +24,7 @@ def init_db():
             
             # Guardar cambios
             db.session.commit()
+            catalog_cache.bump()
             print("Base de datos inicializada con productos de ejemplo")
         else:
             print("La base de datos ya contiene productos")
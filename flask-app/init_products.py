@@ -1,4 +1,4 @@
-from app import app, db
+from app import app, catalog_cache, db
 from models import Product, Category
 
 def init_products():
@@ -177,6 +177,7 @@ def init_products():
         
         # Guardar cambios
         db.session.commit()
+        catalog_cache.bump()
         print("Productos inicializados correctamente")
 
 if __name__ == '__main__':
@@ -0,0 +1,81 @@
+"""Índices para las consultas frecuentes de app.py
+
+Revision ID: 61eba50d5fed
+Revises:
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '61eba50d5fed'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Consolidar filas duplicadas del carrito antes de crear el índice único
+    # (el read-then-write de add_to_cart podía generar duplicados)
+    op.execute("""
+        UPDATE cart_items
+        SET quantity = (
+            SELECT SUM(c2.quantity) FROM cart_items c2
+            WHERE c2.user_id = cart_items.user_id AND c2.product_id = cart_items.product_id
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM cart_items
+            GROUP BY user_id, product_id HAVING COUNT(*) > 1
+        )
+    """)
+    op.execute("""
+        DELETE FROM cart_items
+        WHERE id NOT IN (SELECT MIN(id) FROM cart_items GROUP BY user_id, product_id)
+    """)
+
+    # CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción
+    with op.get_context().autocommit_block():
+        # home(): productos destacados y en promoción
+        op.create_index(
+            'idx_products_featured', 'products', ['id'],
+            postgresql_where=sa.text('is_featured = true'),
+            sqlite_where=sa.text('is_featured = 1'),
+            postgresql_concurrently=True, if_not_exists=True
+        )
+        op.create_index(
+            'idx_products_promotion', 'products', ['id'],
+            postgresql_where=sa.text('is_promotion = true'),
+            sqlite_where=sa.text('is_promotion = 1'),
+            postgresql_concurrently=True, if_not_exists=True
+        )
+        # category_products()
+        op.create_index(
+            'idx_products_category_id', 'products', ['category_id'],
+            postgresql_concurrently=True, if_not_exists=True
+        )
+        # Rutas del carrito: filter_by(user_id, product_id)
+        op.create_index(
+            'idx_cart_items_user_product', 'cart_items', ['user_id', 'product_id'],
+            unique=True, postgresql_concurrently=True, if_not_exists=True
+        )
+        # retorno_webpay(): búsqueda por token
+        op.create_index(
+            'idx_webpay_transactions_token_ws', 'webpay_transactions', ['token_ws'],
+            postgresql_concurrently=True, if_not_exists=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('idx_webpay_transactions_token_ws', table_name='webpay_transactions',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('idx_cart_items_user_product', table_name='cart_items',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('idx_products_category_id', table_name='products',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('idx_products_promotion', table_name='products',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('idx_products_featured', table_name='products',
+                      postgresql_concurrently=True, if_exists=True)
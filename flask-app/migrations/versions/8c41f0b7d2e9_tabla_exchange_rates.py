@@ -0,0 +1,34 @@
+"""Tabla exchange_rates con el histórico de tasas del Banco Central
+
+Revision ID: 8c41f0b7d2e9
+Revises: d2807c7c1ff6
+Create Date: 2026-10-18 15:02:17.114532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41f0b7d2e9'
+down_revision = 'd2807c7c1ff6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'exchange_rates',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('series', sa.String(length=30), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('value', sa.Numeric(precision=14, scale=4), nullable=True),
+        sa.Column('fetched_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        # El índice único (series, date) sirve también para las consultas por rango
+        sa.UniqueConstraint('series', 'date', name='uq_exchange_rates_series_date')
+    )
+
+
+def downgrade():
+    op.drop_table('exchange_rates')
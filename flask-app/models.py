@@ -32,6 +32,17 @@ class Product(db.Model):
     created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
     updated_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), onupdate=db.func.now())
 
+    # Índices de las consultas del catálogo (ver migración 61eba50d5fed)
+    __table_args__ = (
+        db.Index('idx_products_featured', 'id',
+                 postgresql_where=db.text('is_featured = true'),
+                 sqlite_where=db.text('is_featured = 1')),
+        db.Index('idx_products_promotion', 'id',
+                 postgresql_where=db.text('is_promotion = true'),
+                 sqlite_where=db.text('is_promotion = 1')),
+        db.Index('idx_products_category_id', 'category_id'),
+    )
+
     def __repr__(self):
         return f'<Product {self.name}>'
 
@@ -57,6 +68,10 @@ class CartItem(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Integer, default=1, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_cart_items_user_product', 'user_id', 'product_id', unique=True),
+    )
     
     # Relaciones
     user = db.relationship('User', backref=db.backref('cart_items', lazy=True))
@@ -65,6 +80,40 @@ class CartItem(db.Model):
     def __repr__(self):
         return f'<CartItem {self.product_id} ({self.quantity})>'
 
+    @classmethod
+    def add_quantity(cls, user_id, product_id, quantity):
+        """
+        Suma `quantity` unidades al carrito con un único UPSERT atómico
+        (INSERT ... ON CONFLICT (user_id, product_id) DO UPDATE ... RETURNING).
+
+        La validación de stock va dentro de la misma sentencia, por lo que dos
+        clics concurrentes no pueden duplicar filas ni superar el stock.
+
+        Returns:
+            Row con (id, quantity) o None si no hay stock suficiente o el
+            producto no existe.
+        """
+        if db.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        # Solo se inserta si el producto existe y tiene stock para la cantidad pedida
+        source = db.select(
+            db.literal(user_id), Product.id, db.literal(quantity)
+        ).where(Product.id == product_id, Product.stock >= quantity)
+
+        stmt = insert(cls).from_select(['user_id', 'product_id', 'quantity'], source)
+        new_quantity = cls.quantity + stmt.excluded.quantity
+        stock = db.select(Product.stock).where(Product.id == product_id).scalar_subquery()
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.user_id, cls.product_id],
+            set_={'quantity': new_quantity},
+            where=new_quantity <= stock
+        ).returning(cls.id, cls.quantity)
+
+        return db.session.execute(stmt).first()
+
 class Order(db.Model):
     __tablename__ = 'orders'
     
@@ -119,6 +168,10 @@ class WebpayTransaction(db.Model):
     created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
     updated_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), onupdate=db.func.now())
 
+    __table_args__ = (
+        db.Index('idx_webpay_transactions_token_ws', 'token_ws'),
+    )
+
     def __repr__(self):
         return f'<WebpayTransaction {self.id} - Order {self.order_id}>'
 
@@ -150,4 +203,82 @@ class WebpayTransaction(db.Model):
         if response_data.get('response_code') == 0:
             self.status = 'completed'
         else:
-            self.status = 'failed' 
\ No newline at end of file
+            self.status = 'failed' 
+
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(100), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    scope = db.Column(db.String(50), nullable=False)  # Ruta protegida, ej: 'iniciar-pago'
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)  # None mientras la solicitud original está en curso
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'scope', 'key', name='uq_idempotency_keys_user_scope_key'),
+    )
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.scope} {self.key}>'
+
+class EmailOutbox(db.Model):
+    __tablename__ = 'email_outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)  # Tipo de correo, ej: 'comprobante'
+    recipient = db.Column(db.String(120), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='CASCADE'))
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
+    last_error = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime(timezone=True))
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
+
+    __table_args__ = (
+        db.Index('idx_email_outbox_pending', 'next_attempt_at',
+                 postgresql_where=db.text("status = 'pending'"),
+                 sqlite_where=db.text("status = 'pending'")),
+    )
+
+    def __repr__(self):
+        return f'<EmailOutbox {self.id} {self.kind} ({self.status})>'
+
+class ExchangeRate(db.Model):
+    __tablename__ = 'exchange_rates'
+
+    id = db.Column(db.Integer, primary_key=True)
+    series = db.Column(db.String(30), nullable=False)  # Código de serie del Banco Central
+    date = db.Column(db.Date, nullable=False)
+    value = db.Column(db.Numeric(14, 4))  # NULL: el Banco Central no publicó valor ese día
+    fetched_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
+
+    __table_args__ = (
+        db.UniqueConstraint('series', 'date', name='uq_exchange_rates_series_date'),
+    )
+
+    def __repr__(self):
+        return f'<ExchangeRate {self.series} {self.date}: {self.value}>'
+
+    @classmethod
+    def upsert_many(cls, rows):
+        """
+        Inserta o actualiza observaciones (dicts con series, date y value)
+        con un único INSERT ... ON CONFLICT (series, date) DO UPDATE.
+        """
+        if not rows:
+            return
+        if db.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        stmt = insert(cls).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.series, cls.date],
+            set_={'value': stmt.excluded.value, 'fetched_at': db.func.now()}
+        )
+        db.session.execute(stmt)
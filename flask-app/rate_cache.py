@@ -0,0 +1,154 @@
+"""
+Caché compartida de tasas de cambio
+Las tasas se guardan por (serie, día hábil) en Redis si REDIS_URL está
+configurado, o en un archivo SQLite local compartido por todos los workers
+de gunicorn de la máquina.
+"""
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+# Las entradas se conservan mucho más que el TTL para poder servirlas
+# como "stale" mientras se revalidan en segundo plano
+MAX_ENTRY_AGE_SECONDS = 7 * 24 * 3600
+LOCK_SECONDS = 30
+
+
+def business_day(date):
+    """Último día hábil (lunes a viernes) en o antes de `date`"""
+    date = date.date() if hasattr(date, 'date') else date
+    while date.weekday() >= 5:
+        date -= timedelta(days=1)
+    return date
+
+
+def previous_business_day(day):
+    """Día hábil anterior a `day`"""
+    return business_day(day - timedelta(days=1))
+
+
+class SQLiteRateCache:
+    """Caché en un archivo SQLite; una conexión por operación para ser segura entre hilos y procesos"""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rates (
+                    series TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (series, day)
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, series, day):
+        """Devuelve (valor, fetched_at) o None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, fetched_at FROM rates WHERE series = ? AND day = ?",
+                (series, day.isoformat())
+            ).fetchone()
+        if row is None or time.time() - row[1] > MAX_ENTRY_AGE_SECONDS:
+            return None
+        return row
+
+    def latest(self, series):
+        """Entrada más reciente de la serie: (valor, fetched_at, día) o None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, fetched_at, day FROM rates WHERE series = ? ORDER BY day DESC LIMIT 1",
+                (series,)
+            ).fetchone()
+        return row
+
+    def set(self, series, day, value):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO rates (series, day, value, fetched_at) VALUES (?, ?, ?, ?)",
+                (series, day.isoformat(), value, time.time())
+            )
+
+    def acquire(self, name, seconds=LOCK_SECONDS):
+        """Lock entre procesos con expiración; True si se obtuvo"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM locks WHERE name = ? AND expires_at < ?", (name, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO locks (name, expires_at) VALUES (?, ?)", (name, now + seconds)
+            )
+            return cursor.rowcount == 1
+
+    def release(self, name):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM locks WHERE name = ?", (name,))
+
+
+class RedisRateCache:
+    """Caché en Redis, compartida por todas las instancias de la aplicación"""
+
+    PREFIX = 'ferremas:rates'
+
+    def __init__(self, client):
+        self.client = client
+
+    def _key(self, series, day):
+        return f"{self.PREFIX}:{series}:{day.isoformat()}"
+
+    def get(self, series, day):
+        raw = self.client.get(self._key(series, day))
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return entry['value'], entry['fetched_at']
+
+    def latest(self, series):
+        raw = self.client.get(f"{self.PREFIX}:{series}:latest")
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return entry['value'], entry['fetched_at'], entry['day']
+
+    def set(self, series, day, value):
+        entry = {'value': value, 'fetched_at': time.time(), 'day': day.isoformat()}
+        self.client.set(self._key(series, day), json.dumps(entry), ex=MAX_ENTRY_AGE_SECONDS)
+        # Sin vencimiento: es la tasa de respaldo cuando la API está caída
+        latest = self.latest(series)
+        if latest is None or latest[2] <= entry['day']:
+            self.client.set(f"{self.PREFIX}:{series}:latest", json.dumps(entry))
+
+    def acquire(self, name, seconds=LOCK_SECONDS):
+        return bool(self.client.set(f"{self.PREFIX}:lock:{name}", '1', nx=True, ex=seconds))
+
+    def release(self, name):
+        self.client.delete(f"{self.PREFIX}:lock:{name}")
+
+
+def create_rate_cache():
+    """Usa Redis si REDIS_URL está configurado y disponible; si no, un archivo SQLite local"""
+    redis_url = os.getenv('REDIS_URL')
+    if redis_url:
+        try:
+            import redis
+            client = redis.Redis.from_url(redis_url, socket_timeout=1)
+            client.ping()
+            logger.info("Caché de tasas de cambio en Redis")
+            return RedisRateCache(client)
+        except Exception as e:
+            logger.warning(f"Redis no disponible para la caché de tasas, usando SQLite: {str(e)}")
+
+    path = os.getenv('RATE_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'ferremas_rates.sqlite3'))
+    logger.info(f"Caché de tasas de cambio en {path}")
+    return SQLiteRateCache(path)
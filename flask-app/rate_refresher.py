@@ -0,0 +1,171 @@
+"""
+Refresco programado de las tasas de cambio
+Precarga todas las series de CURRENCY_SERIES al iniciar cada worker y las
+vuelve a consultar en los horarios de publicación del Banco Central, para
+que /api/convert siempre responda desde memoria. La API se consulta una
+sola vez por serie y horario entre todos los workers (lock de rate_cache);
+los demás toman la tasa de la caché compartida.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from currency_converter import CURRENCY_SERIES
+from rate_cache import business_day
+
+logger = logging.getLogger(__name__)
+
+# Horarios (hora de Chile) en que el Banco Central ya publicó las series del día
+RATE_REFRESH_TIMES = os.getenv('RATE_REFRESH_TIMES', '09:30,19:00')
+# Espera antes de reintentar una serie que falló
+RATE_RETRY_SECONDS = int(os.getenv('RATE_RETRY_SECONDS', '300'))
+CHILE_TZ = ZoneInfo('America/Santiago')
+
+
+def parse_refresh_times(value):
+    """Convierte '09:30,19:00' en [(9, 30), (19, 0)]"""
+    times = []
+    for part in value.split(','):
+        hour, minute = part.strip().split(':')
+        times.append((int(hour), int(minute)))
+    return sorted(times)
+
+
+def next_refresh_at(now, refresh_times):
+    """Próximo horario de publicación posterior a `now` (datetime con zona horaria)"""
+    for days in range(8):
+        day = (now + timedelta(days=days)).date()
+        for hour, minute in refresh_times:
+            candidate = datetime(day.year, day.month, day.day, hour, minute, tzinfo=now.tzinfo)
+            if candidate > now:
+                return candidate
+    return now + timedelta(days=1)
+
+
+class RateRefresher:
+    """Hilo en segundo plano que mantiene frescas las tasas de un CurrencyConverter"""
+
+    def __init__(self, converter, refresh_times=RATE_REFRESH_TIMES, retry_seconds=RATE_RETRY_SECONDS):
+        self.converter = converter
+        self.refresh_times = parse_refresh_times(refresh_times)
+        self.retry_seconds = retry_seconds
+        self.metrics = {
+            code: {
+                'series': series,
+                'value': None,
+                'day': None,
+                'fetched': None,
+                'last_success': None,
+                'last_attempt': None,
+                'last_error': None,
+                'last_duration_ms': None,
+                'consecutive_failures': 0,
+            }
+            for code, series in CURRENCY_SERIES.items()
+        }
+        self.next_refresh = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._fork_handler_registered = False
+
+    def refresh_series(self, currency_code, fresh_after=None):
+        """
+        Refresca una serie; devuelve True si hay una tasa fresca.
+
+        La API se consulta con el lock compartido de la serie y solo si la
+        caché no tiene una tasa obtenida después de `fresh_after`: con varios
+        workers, solo uno consulta al Banco Central por serie y horario.
+        """
+        metrics = self.metrics[currency_code]
+        started = time.perf_counter()
+        metrics['last_attempt'] = time.time()
+        try:
+            result = self.converter.revalidate_rate(currency_code, fresh_after)
+            if result is None:
+                # Otro worker está consultando la serie: se reintenta más tarde
+                return False
+            value, fetched = result
+            metrics.update({
+                'value': value,
+                'day': business_day(datetime.now()).isoformat(),
+                'fetched': fetched,
+                'last_success': time.time(),
+                'last_error': None,
+                'consecutive_failures': 0,
+            })
+            return True
+        except ValueError as e:
+            metrics['last_error'] = str(e)
+            metrics['consecutive_failures'] += 1
+            logger.warning(f"No se pudo refrescar la tasa de {currency_code}: {str(e)}")
+            return False
+        finally:
+            metrics['last_duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    def refresh_all(self, currency_codes=None, fresh_after=None):
+        """Refresca las series en paralelo; devuelve los códigos que fallaron"""
+        currency_codes = list(currency_codes or CURRENCY_SERIES)
+        with ThreadPoolExecutor(max_workers=len(currency_codes)) as executor:
+            results = list(executor.map(lambda code: self.refresh_series(code, fresh_after), currency_codes))
+        failed = [code for code, ok in zip(currency_codes, results) if not ok]
+        logger.info(f"Tasas de cambio refrescadas: {len(results) - len(failed)} ok, {len(failed)} con error")
+        return failed
+
+    def _run(self):
+        currency_codes = list(CURRENCY_SERIES)
+        # Al iniciar, una tasa dentro de RATE_CACHE_TTL ya sirve
+        fresh_after = None
+        while True:
+            failed = self.refresh_all(currency_codes, fresh_after)
+            now = datetime.now(CHILE_TZ)
+            scheduled = next_refresh_at(now, self.refresh_times)
+            retry_at = now + timedelta(seconds=self.retry_seconds)
+            if failed and retry_at < scheduled:
+                # Reintentar solo las series que fallaron
+                self.next_refresh, currency_codes = retry_at, failed
+            else:
+                self.next_refresh, currency_codes = scheduled, list(CURRENCY_SERIES)
+            self._wake.wait((self.next_refresh - now).total_seconds())
+            self._wake.clear()
+            # Lo que otro worker obtuvo desde este horario ya está fresco
+            fresh_after = min(self.next_refresh, datetime.now(CHILE_TZ)).timestamp()
+
+    def start(self):
+        """Inicia el hilo; en servidores con fork (gunicorn) se reinicia en cada worker"""
+        if not self._fork_handler_registered:
+            # Los hilos no sobreviven al fork: cada worker necesita el suyo
+            os.register_at_fork(after_in_child=self._restart_after_fork)
+            self._fork_handler_registered = True
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='rate-refresher', daemon=True)
+            self._thread.start()
+
+    def _restart_after_fork(self):
+        self._thread = None
+        self._wake = threading.Event()
+        self.start()
+
+    def refresh_now(self):
+        """Adelanta el próximo refresco (ej: desde un comando de administración)"""
+        self._wake.set()
+
+    def freshness(self):
+        """Métricas de frescura por serie, en segundos desde el último refresco exitoso"""
+        now = time.time()
+        result = {}
+        for code, metrics in self.metrics.items():
+            entry = dict(metrics)
+            entry['age_seconds'] = round(now - metrics['last_success'], 1) if metrics['last_success'] else None
+            for key in ('last_success', 'last_attempt'):
+                if entry[key] is not None:
+                    entry[key] = datetime.fromtimestamp(entry[key], CHILE_TZ).isoformat()
+            result[code] = entry
+        return {
+            'series': result,
+            'next_refresh': self.next_refresh.isoformat() if self.next_refresh else None,
+            'running': bool(self._thread and self._thread.is_alive()),
+        }
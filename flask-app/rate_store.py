@@ -0,0 +1,136 @@
+"""
+Histórico persistente de tasas de cambio
+Guarda en la tabla exchange_rates cada observación que entrega la API del
+Banco Central, y responde consultas históricas y por rango desde la base de
+datos, descargando de la API solo las fechas que faltan.
+"""
+import logging
+from datetime import date as date_type, datetime, timedelta
+from decimal import Decimal
+
+from circuit_breaker import CircuitOpenError
+from currency_converter import CURRENCY_SERIES
+from extensions import db
+from models import ExchangeRate
+
+logger = logging.getLogger(__name__)
+
+# Días tras los cuales un día sin valor publicado (fin de semana, feriado) se da por definitivo
+UNPUBLISHED_FINAL_DAYS = 3
+# Rango máximo de una consulta histórica
+RATE_RANGE_MAX_DAYS = 3660
+# Ventana hacia atrás para encontrar la última tasa publicada en o antes de una fecha
+LOOKBACK_DAYS = 5
+
+
+class RateSourceError(ValueError):
+    """La API del Banco Central falló al completar fechas faltantes (no es un error del cliente)"""
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _missing_runs(days):
+    """Agrupa fechas ordenadas en tramos consecutivos [(inicio, fin), ...]"""
+    runs = []
+    for day in days:
+        if runs and day - runs[-1][1] == timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(run) for run in runs]
+
+
+def _parse_observation(observation):
+    """Convierte una observación de la API en (fecha, valor o None)"""
+    day = datetime.strptime(observation['indexDateString'], '%d-%m-%Y').date()
+    if observation.get('statusCode') != 'OK':
+        return day, None
+    try:
+        return day, Decimal(observation['value'])
+    except (KeyError, ArithmeticError):
+        return day, None
+
+
+def backfill(converter, currency_code, start, end):
+    """
+    Descarga de la API los tramos del rango que aún no están en la tabla,
+    con una sola solicitud por tramo consecutivo, y los guarda.
+
+    Returns:
+        int: cantidad de observaciones guardadas
+    """
+    series = CURRENCY_SERIES[currency_code]
+    known = set(db.session.execute(
+        db.select(ExchangeRate.date)
+        .where(ExchangeRate.series == series, ExchangeRate.date.between(start, end))
+    ).scalars())
+    missing = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    missing = [day for day in missing if day not in known]
+    if not missing:
+        return 0
+
+    final_before = date_type.today() - timedelta(days=UNPUBLISHED_FINAL_DAYS)
+    rows = []
+    for run_start, run_end in _missing_runs(missing):
+        try:
+            observations = converter._fetch_observations(currency_code, run_start, run_end)
+        except CircuitOpenError:
+            raise
+        except ValueError as e:
+            raise RateSourceError(str(e)) from e
+        for observation in observations:
+            try:
+                day, value = _parse_observation(observation)
+            except (KeyError, ValueError):
+                continue
+            # Un día reciente sin valor puede publicarse más tarde: no se guarda aún
+            if value is None and day >= final_before:
+                continue
+            rows.append({'series': series, 'date': day, 'value': value})
+
+    ExchangeRate.upsert_many(rows)
+    db.session.commit()
+    logger.info(f"Histórico de {currency_code}: {len(rows)} observaciones guardadas entre {start} y {end}")
+    return len(rows)
+
+
+def get_rate_range(converter, currency_code, start, end):
+    """
+    Tasas publicadas de una moneda entre dos fechas (inclusive).
+
+    Returns:
+        list: pares (fecha, Decimal) ordenados por fecha
+
+    Raises:
+        ValueError: si la moneda no está soportada o el rango es inválido
+        RateSourceError: si la API falla al completar fechas faltantes
+        CircuitOpenError: si la API está marcada como caída
+    """
+    if currency_code not in CURRENCY_SERIES:
+        raise ValueError(f"Moneda no soportada: {currency_code}")
+    start, end = _as_date(start), min(_as_date(end), date_type.today())
+    if start > end:
+        raise ValueError("La fecha inicial debe ser anterior a la final")
+    if (end - start).days > RATE_RANGE_MAX_DAYS:
+        raise ValueError(f"El rango máximo es de {RATE_RANGE_MAX_DAYS} días")
+
+    backfill(converter, currency_code, start, end)
+    rows = db.session.execute(
+        db.select(ExchangeRate.date, ExchangeRate.value)
+        .where(ExchangeRate.series == CURRENCY_SERIES[currency_code],
+               ExchangeRate.date.between(start, end),
+               ExchangeRate.value.isnot(None))
+        .order_by(ExchangeRate.date)
+    ).all()
+    return [(row.date, row.value) for row in rows]
+
+
+def get_historical_rate(converter, currency_code, day):
+    """Última tasa publicada en o antes de `day` (fin de semana y feriados usan la anterior)"""
+    day = _as_date(day)
+    rates = get_rate_range(converter, currency_code, day - timedelta(days=LOOKBACK_DAYS), day)
+    if not rates:
+        raise ValueError(f"No hay observaciones válidas para {currency_code}")
+    return float(rates[-1][1])
@@ -0,0 +1,204 @@
+"""
+Reconciliación de pagos Webpay
+Recupera transacciones y órdenes que quedaron a medio camino en el checkout
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from extensions import db
+from email_outbox import enqueue_receipt
+from models import Order, WebpayTransaction
+from stock import close_pending_orders, complete_order
+
+logger = logging.getLogger(__name__)
+
+# Minutos tras los cuales una transacción sin token se considera abandonada
+ORPHAN_TRANSACTION_MINUTES = 30
+
+# Minutos tras los cuales una transacción con token se consulta en Webpay
+STALE_TRANSACTION_MINUTES = 30
+# Transbank solo permite consultar el estado de un token durante 7 días
+STATUS_LOOKUP_MAX_DAYS = 7
+SWEEP_BATCH_SIZE = 200
+SWEEP_MAX_WORKERS = 8
+
+# Estados de Webpay que cierran la transacción en nuestro lado
+WEBPAY_APPROVED_STATUSES = {'AUTHORIZED', 'CAPTURED'}
+WEBPAY_REJECTED_STATUSES = {'FAILED', 'REVERSED', 'NULLIFIED'}
+
+
+def mark_transaction_failed(transaction_id, status='failed'):
+    """
+    Marca una transacción y su orden con el estado indicado en una
+    transacción corta e independiente del request que falló, liberando
+    el stock reservado por la orden.
+
+    Returns:
+        bool: True si se pudo registrar el estado
+    """
+    try:
+        order_id = (db.session.query(WebpayTransaction.order_id)
+                    .filter(WebpayTransaction.id == transaction_id)
+                    .scalar())
+        WebpayTransaction.query.filter_by(id=transaction_id).update(
+            {'status': status}, synchronize_session=False)
+        # Cierra la orden y devuelve el stock reservado
+        close_pending_orders([order_id], status)
+        db.session.commit()
+        return True
+    except Exception as e:
+        # La reconciliación periódica se encargará de esta transacción
+        logger.error(f"No se pudo marcar la transacción {transaction_id} como {status}: {str(e)}")
+        db.session.rollback()
+        return False
+
+
+def reconcile_orders_without_token(max_age_minutes=ORPHAN_TRANSACTION_MINUTES):
+    """
+    Marca como fallidas las transacciones que quedaron en 'initiated' sin
+    token_ws (la llamada a Webpay falló o el proceso murió antes de guardar
+    el token) y que son más antiguas que `max_age_minutes`.
+
+    Returns:
+        int: Cantidad de transacciones reconciliadas
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes=max_age_minutes)
+    orphans = (db.session.query(WebpayTransaction.id, WebpayTransaction.order_id)
+               .filter(WebpayTransaction.token_ws.is_(None),
+                       WebpayTransaction.status == 'initiated',
+                       WebpayTransaction.created_at < cutoff)
+               .all())
+    if not orphans:
+        return 0
+
+    transaction_ids = [row.id for row in orphans]
+    order_ids = [row.order_id for row in orphans]
+
+    # Repetir el filtro de estado evita pisar una transacción que cambió entretanto
+    updated = (WebpayTransaction.query
+               .filter(WebpayTransaction.id.in_(transaction_ids),
+                       WebpayTransaction.status == 'initiated')
+               .update({'status': 'failed'}, synchronize_session=False))
+    close_pending_orders(order_ids, 'failed')
+    db.session.commit()
+
+    logger.info(f"Transacciones sin token reconciliadas: {updated}")
+    return updated
+
+
+def _as_utc(value):
+    """SQLite devuelve fechas sin zona horaria; se asumen en UTC"""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _fetch_status(webpay, token):
+    """Consulta el estado de un token en Webpay; devuelve (respuesta, error)"""
+    try:
+        return webpay.status(token), None
+    except Exception as e:
+        return None, e
+
+
+def _apply_status(transaction, response, error, now):
+    """
+    Aplica a la transacción (bloqueada) la respuesta de status() de Webpay.
+
+    Returns:
+        str: resultado ('completed', 'review', 'failed', 'cancelled', 'skipped' o 'error')
+    """
+    if error is not None:
+        # Pasado el plazo de consulta el token ya no existe en Transbank
+        if transaction.created_at and _as_utc(transaction.created_at) < now - timedelta(days=STATUS_LOOKUP_MAX_DAYS):
+            transaction.status = 'failed'
+            close_pending_orders([transaction.order_id], 'failed')
+            return 'failed'
+        logger.warning(f"No se pudo consultar el token de la transacción {transaction.id}: {str(error)}")
+        return 'error'
+
+    webpay_status = response.get('status')
+    if webpay_status in WEBPAY_APPROVED_STATUSES and response.get('response_code') == 0:
+        transaction.update_from_response(response)
+        transaction.status = 'completed'
+        transaction.amount = response.get('amount', transaction.amount)
+        previous_status = db.session.query(Order.status).filter(Order.id == transaction.order_id).scalar()
+        # Si la orden ya estaba cerrada se vuelve a reservar su stock o queda en 'review'
+        order_status = complete_order(transaction.order_id)
+        if previous_status not in ('completed', 'review') and transaction.order and transaction.order.user:
+            enqueue_receipt(transaction.order_id, transaction.order.user.email)
+        if order_status == 'review':
+            logger.warning(f"Orden {transaction.order_id} pagada sin stock disponible: queda en revisión manual")
+            return 'review'
+        return 'completed'
+
+    if webpay_status in WEBPAY_REJECTED_STATUSES or webpay_status in WEBPAY_APPROVED_STATUSES:
+        transaction.update_from_response(response)
+        transaction.status = 'failed'
+        close_pending_orders([transaction.order_id], 'failed')
+        return 'failed'
+
+    if webpay_status == 'INITIALIZED':
+        # El comprador abandonó el formulario de pago y el token expiró
+        transaction.status = 'cancelled'
+        close_pending_orders([transaction.order_id], 'cancelled')
+        return 'cancelled'
+
+    logger.warning(f"Estado de Webpay desconocido para la transacción {transaction.id}: {webpay_status}")
+    return 'skipped'
+
+
+def sweep_stale_transactions(webpay, max_age_minutes=STALE_TRANSACTION_MINUTES,
+                             batch_size=SWEEP_BATCH_SIZE, max_workers=SWEEP_MAX_WORKERS):
+    """
+    Reconcilia con Webpay las transacciones con token que quedaron sin
+    respuesta porque el comprador nunca volvió a /retorno-webpay.
+
+    Cada lote se toma con SELECT ... FOR UPDATE SKIP LOCKED, así varias
+    instancias del job pueden correr en paralelo sin consultar dos veces el
+    mismo token, y retorno_webpay() nunca espera más que un lote. Las
+    consultas a Webpay se hacen en un pool de `max_workers` hilos; solo el
+    hilo principal toca la sesión de base de datos.
+
+    Args:
+        webpay: instancia de WebpayPlus (o cualquier objeto con status(token))
+
+    Returns:
+        dict: cantidad de transacciones por resultado
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes=max_age_minutes)
+    results = {'completed': 0, 'review': 0, 'failed': 0, 'cancelled': 0, 'skipped': 0, 'error': 0}
+    # Transacciones que no se pudieron resolver en esta pasada
+    unresolved_ids = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            query = (WebpayTransaction.query
+                     .filter(WebpayTransaction.status.in_(['initiated', 'pending']),
+                             WebpayTransaction.token_ws.isnot(None),
+                             WebpayTransaction.created_at < cutoff))
+            if unresolved_ids:
+                query = query.filter(WebpayTransaction.id.notin_(unresolved_ids))
+            transactions = (query
+                            .order_by(WebpayTransaction.id)
+                            .limit(batch_size)
+                            .with_for_update(skip_locked=True)
+                            .all())
+            if not transactions:
+                db.session.commit()
+                break
+
+            tokens = [transaction.token_ws for transaction in transactions]
+            responses = executor.map(lambda token: _fetch_status(webpay, token), tokens)
+            now = datetime.now(timezone.utc)
+            for transaction, (response, error) in zip(transactions, responses):
+                outcome = _apply_status(transaction, response, error, now)
+                results[outcome] += 1
+                if outcome in ('skipped', 'error'):
+                    unresolved_ids.append(transaction.id)
+            db.session.commit()
+
+            if len(transactions) < batch_size:
+                break
+
+    logger.info(f"Barrido de transacciones Webpay: {results}")
+    return results
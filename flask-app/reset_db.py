@@ -1,4 +1,4 @@
-from app import app, db
+from app import app, catalog_cache, db
 from models import Category, Product, User, CartItem, Order, OrderItem, WebpayTransaction
 
 def reset_database():
@@ -62,6 +62,7 @@ def reset_database():
         
         # Guardar cambios
         db.session.commit()
+        catalog_cache.bump()
         print("Categorías inicializadas correctamente")
         
         # Verificar categorías creadas
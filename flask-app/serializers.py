@@ -0,0 +1,66 @@
+"""
+Serialización rápida para las rutas más usadas (catálogo y carrito)
+Se seleccionan solo las columnas necesarias como tuplas, sin instanciar
+objetos del ORM, y se codifican con orjson si está instalado. La salida
+tiene los mismos campos que ProductSchema y CartItemSchema; los esquemas
+de marshmallow se mantienen para validar la entrada y en las rutas poco
+usadas.
+"""
+import json
+
+from flask import current_app
+
+from models import CartItem, Product
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Mismos campos y orden que ProductSchema / CartItemSchema
+PRODUCT_FIELDS = ('id', 'name', 'price', 'image', 'is_promotion', 'promotion_price')
+PRODUCT_COLUMNS = tuple(getattr(Product, field) for field in PRODUCT_FIELDS)
+CART_ITEM_FIELDS = ('id', 'user_id', 'product_id', 'quantity')
+CART_ITEM_COLUMNS = tuple(getattr(CartItem, field) for field in CART_ITEM_FIELDS)
+# Exportación completa del catálogo (definición Product de Swagger + updated_at)
+EXPORT_FIELDS = PRODUCT_FIELDS + ('description', 'stock', 'is_featured', 'category_id', 'updated_at')
+EXPORT_COLUMNS = tuple(getattr(Product, field) for field in EXPORT_FIELDS)
+
+
+def product_from_row(row, offset=0):
+    """Dict de producto desde una fila de PRODUCT_COLUMNS (a partir de `offset`)"""
+    return dict(zip(PRODUCT_FIELDS, row[offset:offset + len(PRODUCT_FIELDS)]))
+
+
+def cart_item_from_row(row):
+    """Dict de item desde una fila de CART_ITEM_COLUMNS + PRODUCT_COLUMNS"""
+    item = dict(zip(CART_ITEM_FIELDS, row))
+    # Con LEFT JOIN, un producto eliminado deja todas sus columnas en None
+    item['product'] = product_from_row(row, len(CART_ITEM_FIELDS)) if row[len(CART_ITEM_FIELDS)] is not None else None
+    return item
+
+
+def dumps(data):
+    """Codifica a JSON (str); orjson es varias veces más rápido que json"""
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def ndjson_chunk(rows):
+    """Un bloque NDJSON (bytes, una línea por producto) desde filas de EXPORT_COLUMNS"""
+    lines = []
+    for row in rows:
+        product = dict(zip(EXPORT_FIELDS, row))
+        if product['updated_at'] is not None:
+            product['updated_at'] = product['updated_at'].isoformat()
+        lines.append(dumps(product))
+    lines.append('')
+    return '\n'.join(lines).encode()
+
+
+def json_response(payload, status=200):
+    """Respuesta con un JSON ya codificado (str) o con datos a codificar"""
+    if not isinstance(payload, str):
+        payload = orjson.dumps(payload) if orjson is not None else dumps(payload)
+    return current_app.response_class(payload, status=status, mimetype='application/json')
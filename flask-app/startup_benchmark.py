@@ -0,0 +1,94 @@
+"""
+Benchmark de arranque de la aplicación
+Lanza intérpretes nuevos (como un worker de gunicorn recién creado) y mide
+cuánto tarda `import app` y cuánto la primera petición, que es donde ahora se
+inicializan los clientes externos (Webpay, caché de tasas).
+
+Uso:
+    python startup_benchmark.py --runs 10
+    python startup_benchmark.py --runs 5 --path /api/currencies --json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Se ejecuta en cada proceso hijo; imprime los tiempos como JSON en la última línea
+CHILD_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+response = app_module.app.test_client().get(sys.argv[1])
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (served - imported) * 1000,
+    'status': response.status_code,
+}))
+"""
+
+
+def measure_startup(path='/api/currencies'):
+    """
+    Arranca un intérprete, importa la app y sirve una petición.
+
+    Returns:
+        dict: import_ms, first_request_ms, process_ms (desde el spawn hasta
+        que el proceso termina) y el status HTTP de la petición
+    """
+    env = dict(os.environ)
+    # El benchmark no debe depender de la API del Banco Central
+    env.setdefault('RATE_PREFETCH', 'false')
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD_SCRIPT, path],
+        cwd=APP_DIR, env=env, capture_output=True, text=True
+    )
+    process_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"El proceso de prueba falló:\n{result.stderr[-2000:]}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['process_ms'] = process_ms
+    return timings
+
+
+def run_benchmark(runs=10, path='/api/currencies'):
+    """
+    Mide `runs` arranques en frío.
+
+    Returns:
+        dict: mediana, p95 y máximo en milisegundos de cada etapa
+    """
+    samples = [measure_startup(path) for _ in range(runs)]
+    stats = {'runs': runs, 'path': path, 'status': samples[-1]['status']}
+    for key in ('import_ms', 'first_request_ms', 'process_ms'):
+        values = sorted(sample[key] for sample in samples)
+        stats[f'{key}_p50'] = round(statistics.median(values), 1)
+        stats[f'{key}_p95'] = round(values[min(len(values) - 1, int(len(values) * 0.95))], 1)
+        stats[f'{key}_max'] = round(values[-1], 1)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de arranque de la aplicación')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/api/currencies', help='Ruta de la primera petición')
+    parser.add_argument('--json', action='store_true', help='Imprime el resultado como JSON (para CI)')
+    args = parser.parse_args()
+
+    stats = run_benchmark(args.runs, args.path)
+    if args.json:
+        print(json.dumps(stats))
+        return
+    for key, value in stats.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
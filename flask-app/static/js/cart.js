@@ -203,10 +203,10 @@ function updateCartUI(cartItems) {
                     </div>
                     <div class="col-md-3">
                         <div class="quantity-control">
-                            <button onclick="updateQuantity(${item.id}, ${item.quantity - 1})">-</button>
+                            <button onclick="changeQuantity(${item.id}, -1)">-</button>
                             <input type="number" value="${item.quantity}" min="1" max="99" 
                                    onchange="updateQuantity(${item.id}, this.value)">
-                            <button onclick="updateQuantity(${item.id}, ${item.quantity + 1})">+</button>
+                            <button onclick="changeQuantity(${item.id}, 1)">+</button>
                         </div>
                     </div>
                     <div class="col-md-2">
@@ -240,34 +240,65 @@ function updateCartTotals(subtotal, tax, total) {
     document.getElementById('cart-total').textContent = `$${total.toFixed(2)}`;
 }
 
+// Cambios de cantidad pendientes; se envían juntos a /api/cart/batch
+const pendingCartOps = new Map();
+let cartOpsTimer = null;
+const CART_OPS_DELAY_MS = 300;
+
 // Actualizar cantidad de un producto en el carrito
-async function updateQuantity(itemId, newQuantity) {
+function updateQuantity(itemId, newQuantity) {
     if (newQuantity < 1) newQuantity = 1;
     if (newQuantity > 99) newQuantity = 99;
     
+    // Solo importa la última cantidad de cada item
+    pendingCartOps.set(itemId, { op: 'update', item_id: itemId, quantity: parseInt(newQuantity) });
+    
+    clearTimeout(cartOpsTimer);
+    cartOpsTimer = setTimeout(flushCartOps, CART_OPS_DELAY_MS);
+}
+
+// Sumar o restar unidades partiendo del valor mostrado (admite clics seguidos)
+function changeQuantity(itemId, delta) {
+    const input = document.querySelector(`.cart-item[data-id="${itemId}"] input`);
+    if (!input) return;
+    
+    const newQuantity = Math.min(99, Math.max(1, parseInt(input.value) + delta));
+    input.value = newQuantity;
+    updateQuantity(itemId, newQuantity);
+}
+
+// Enviar en una sola solicitud todos los cambios acumulados
+async function flushCartOps() {
+    if (pendingCartOps.size === 0) return;
+    
+    const operations = Array.from(pendingCartOps.values());
+    pendingCartOps.clear();
+    
     try {
-        const response = await fetch(`/api/cart/update/${itemId}`, {
-            method: 'PUT',
+        const response = await fetch('/api/cart/batch', {
+            method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ quantity: parseInt(newQuantity) }),
+            body: JSON.stringify({ operations }),
         });
         
         if (!response.ok) {
             throw new Error('Error al actualizar la cantidad');
         }
         
-        // Verificar si estamos en la página del carrito antes de intentar recargar la vista
-        const isCartPage = document.getElementById('cart-items') !== null;
-        if (isCartPage) {
-            await loadCart();
+        // La respuesta trae el carrito resultante; no hace falta volver a pedirlo
+        const cartItems = await response.json();
+        if (document.getElementById('cart-items') !== null) {
+            updateCartUI(cartItems);
         }
         
         // Actualizar contador del carrito (esto funciona en todas las páginas)
         await updateCartCount();
     } catch (error) {
         console.error('Error:', error);
+        // Recargar el estado real del carrito si el lote fue rechazado
+        await loadCart();
     }
 }
 
@@ -360,15 +391,16 @@ async function updateCartCount() {
     if (!cartCountElement) return;
     
     try {
-        const response = await fetch('/api/cart');
+        // El resumen trae ETag: el navegador revalida y recibe 304 si no cambió
+        const response = await fetch('/api/cart/summary');
         // Si no estamos autenticados o hay otro error, ocultar el contador
         if (!response.ok) {
             cartCountElement.style.display = 'none';
             return;
         }
         
-        const cartItems = await response.json();
-        const count = cartItems.reduce((total, item) => total + item.quantity, 0);
+        const summary = await response.json();
+        const count = summary.item_count;
         
         if (count > 0) {
             cartCountElement.textContent = count > 9 ? '9+' : count;
@@ -382,8 +414,23 @@ async function updateCartCount() {
     }
 }
 
+// Clave de idempotencia del intento de pago actual: un doble clic reutiliza
+// la misma clave y el servidor responde sin crear otra orden
+let checkoutIdempotencyKey = null;
+
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+}
+
 // Iniciar proceso de pago con Webpay
 async function iniciarPago() {
+    if (!checkoutIdempotencyKey) {
+        checkoutIdempotencyKey = newIdempotencyKey();
+    }
+    
     const loadingOverlay = document.createElement('div');
     loadingOverlay.style.cssText = `
         position: fixed;
@@ -413,13 +460,20 @@ async function iniciarPago() {
         const response = await fetch('/iniciar-pago', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'Idempotency-Key': checkoutIdempotencyKey
             }
         });
 
         console.log('Respuesta recibida:', response);
 
         if (!response.ok) {
+            // 409: el intento anterior con esta clave sigue en curso; se conserva
+            // la clave para que el reintento no cree una segunda orden. Cualquier
+            // otro error es definitivo: el servidor ya liberó la clave
+            if (response.status !== 409) {
+                checkoutIdempotencyKey = null;
+            }
             const errorData = await response.json();
             console.error('Error en la respuesta:', errorData);
             throw new Error(errorData.error || 'Error al iniciar el pago');
@@ -429,6 +483,7 @@ async function iniciarPago() {
         console.log('Datos de redirección recibidos:', data);
         
         if (!data.token || !data.url) {
+            checkoutIdempotencyKey = null;
             console.error('Datos de redirección inválidos:', data);
             throw new Error('Datos de redirección inválidos');
         }
@@ -456,6 +511,7 @@ async function iniciarPago() {
         
     } catch (error) {
         console.error('Error:', error);
+        // Ante un error de red la clave se conserva: la solicitud pudo llegar al servidor
         alert('Ha ocurrido un error al procesar el pago. Por favor, intente nuevamente.');
         // Remover overlay de carga en caso de error
         loadingOverlay.remove();
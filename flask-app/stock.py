@@ -0,0 +1,133 @@
+"""
+Reserva de stock para el checkout
+Descuenta y devuelve stock con UPDATE condicionales, sin leer antes de escribir
+"""
+from collections import Counter
+
+from extensions import db
+from models import Order, OrderItem, Product
+
+
+def _group_quantities(lines):
+    """Agrupa pares (product_id, quantity) sumando cantidades por producto"""
+    quantities = Counter()
+    for product_id, quantity in lines:
+        quantities[product_id] += quantity
+    return dict(quantities)
+
+
+def reserve_stock(lines):
+    """
+    Descuenta el stock de todas las líneas con un único UPDATE condicional:
+    UPDATE products SET stock = stock - q WHERE id = :id AND stock >= q
+
+    La condición la evalúa la base de datos sobre la fila bloqueada, así que
+    dos compradores concurrentes nunca pueden sobrevender el mismo producto.
+    Si alguna línea no tiene stock suficiente, el llamador debe hacer rollback
+    para deshacer las líneas que sí se descontaron.
+
+    Args:
+        lines: iterable de pares (product_id, quantity)
+
+    Returns:
+        bool: True si se reservaron todas las líneas
+    """
+    quantities = _group_quantities(lines)
+    if not quantities:
+        return True
+
+    requested = db.case(quantities, value=Product.id)
+    result = db.session.execute(
+        db.update(Product)
+        .where(Product.id.in_(quantities.keys()), Product.stock >= requested)
+        .values(stock=Product.stock - requested)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == len(quantities)
+
+
+def release_stock(lines):
+    """Devuelve al inventario las cantidades reservadas por reserve_stock()"""
+    quantities = _group_quantities(lines)
+    if not quantities:
+        return
+
+    db.session.execute(
+        db.update(Product)
+        .where(Product.id.in_(quantities.keys()))
+        .values(stock=Product.stock + db.case(quantities, value=Product.id))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def close_pending_orders(order_ids, status):
+    """
+    Cambia órdenes de 'pending' al estado final indicado ('failed' o
+    'cancelled') y libera el stock que tenían reservado.
+
+    El cambio de estado es condicional, por lo que el stock de una orden se
+    libera una sola vez aunque retorno_webpay() y la reconciliación compitan.
+
+    Returns:
+        list: ids de las órdenes que efectivamente se cerraron
+    """
+    order_ids = [order_id for order_id in order_ids if order_id is not None]
+    if not order_ids:
+        return []
+
+    closed_ids = db.session.execute(
+        db.update(Order)
+        .where(Order.id.in_(order_ids), Order.status == 'pending')
+        .values(status=status)
+        .returning(Order.id)
+    ).scalars().all()
+
+    if closed_ids:
+        lines = (db.session.query(OrderItem.product_id, OrderItem.quantity)
+                 .filter(OrderItem.order_id.in_(closed_ids),
+                         OrderItem.product_id.isnot(None))
+                 .all())
+        release_stock(lines)
+    return closed_ids
+
+
+def complete_order(order_id):
+    """
+    Marca como 'completed' una orden pagada con un UPDATE condicional:
+    UPDATE orders SET status = 'completed' WHERE id = :id AND status = 'pending'
+
+    Si la orden ya se había cerrado ('failed' o 'cancelled'), su stock fue
+    liberado y puede haberse vendido de nuevo: se intenta reservarlo otra vez
+    y, si ya no alcanza, la orden queda en 'review' para revisión manual en
+    lugar de completarse sobre un stock que no existe.
+
+    Returns:
+        str: estado final de la orden ('completed' o 'review')
+    """
+    completed = db.session.execute(
+        db.update(Order)
+        .where(Order.id == order_id, Order.status == 'pending')
+        .values(status='completed')
+    ).rowcount
+    if completed:
+        return 'completed'
+
+    status = db.session.execute(db.select(Order.status).where(Order.id == order_id)).scalar_one()
+    if status not in ('failed', 'cancelled'):
+        # Retorno repetido de una orden ya completada (o ya en revisión)
+        return status
+
+    lines = (db.session.query(OrderItem.product_id, OrderItem.quantity)
+             .filter(OrderItem.order_id == order_id, OrderItem.product_id.isnot(None))
+             .all())
+    # SAVEPOINT: si falta stock se deshacen las líneas que sí se descontaron
+    # sin perder el resto de la transacción del llamador
+    savepoint = db.session.begin_nested()
+    if reserve_stock(lines):
+        savepoint.commit()
+        status = 'completed'
+    else:
+        savepoint.rollback()
+        status = 'review'
+    db.session.execute(db.update(Order).where(Order.id == order_id).values(status=status))
+    return status
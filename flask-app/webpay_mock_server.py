@@ -0,0 +1,166 @@
+"""
+Servidor local que imita la API REST de Webpay Plus (v1.2)
+Permite pruebas de carga del checkout sin depender del ambiente de
+integración de Transbank. Implementa create, commit, status y refund con
+latencia y tasas de error configurables.
+
+Uso:
+    python webpay_mock_server.py --port 8090 --latency-ms 300 --failure-rate 0.02
+    WEBPAY_BASE_URL=http://localhost:8090 gunicorn --workers 3 app:app
+"""
+import argparse
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import Flask, jsonify, request
+
+WEBPAY_ENDPOINT = '/rswebpaytransaction/api/webpay/v1.2/transactions'
+
+
+def create_mock_app(latency_ms=0, jitter_ms=0, failure_rate=0.0, reject_rate=0.0):
+    """
+    Crea la aplicación mock.
+
+    Args:
+        latency_ms: latencia media agregada a cada respuesta
+        jitter_ms: variación aleatoria (+/-) de la latencia
+        failure_rate: fracción de llamadas que responden HTTP 500
+        reject_rate: fracción de pagos que el "banco" rechaza en el commit
+    """
+    app = Flask(__name__)
+    transactions = {}
+    lock = threading.Lock()
+
+    def simulate_network():
+        delay = latency_ms + random.uniform(-jitter_ms, jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if random.random() < failure_rate:
+            return jsonify({'error_message': 'Error simulado del servidor mock'}), 500
+        return None
+
+    def find(token):
+        with lock:
+            return transactions.get(token)
+
+    def not_found():
+        return jsonify({'error_message': 'Transaction not found'}), 422
+
+    def status_body(tx):
+        body = {
+            'vci': 'TSY' if tx['status'] == 'AUTHORIZED' else None,
+            'amount': tx['amount'],
+            'status': tx['status'],
+            'buy_order': tx['buy_order'],
+            'session_id': tx['session_id'],
+            'card_detail': {'card_number': '6623'},
+            'accounting_date': datetime.now().strftime('%m%d'),
+            'transaction_date': tx['created_at'],
+            'installments_number': 0,
+        }
+        if tx['status'] != 'INITIALIZED':
+            body.update({
+                'authorization_code': tx['authorization_code'],
+                'payment_type_code': 'VD',
+                'response_code': tx['response_code'],
+            })
+        return body
+
+    @app.route(WEBPAY_ENDPOINT, methods=['POST'])
+    @app.route(WEBPAY_ENDPOINT + '/', methods=['POST'])
+    def create():
+        error = simulate_network()
+        if error:
+            return error
+        data = request.get_json(force=True)
+        # Los tokens de Webpay son de 64 caracteres
+        token = uuid.uuid4().hex + uuid.uuid4().hex
+        with lock:
+            transactions[token] = {
+                'buy_order': data.get('buy_order'),
+                'session_id': data.get('session_id'),
+                'amount': data.get('amount'),
+                'return_url': data.get('return_url'),
+                'status': 'INITIALIZED',
+                'created_at': datetime.now(timezone.utc).isoformat(),
+            }
+        return jsonify({'token': token, 'url': request.host_url.rstrip('/') + '/webpayserver/initTransaction'})
+
+    @app.route(WEBPAY_ENDPOINT + '/<token>', methods=['PUT'])
+    def commit(token):
+        error = simulate_network()
+        if error:
+            return error
+        with lock:
+            tx = transactions.get(token)
+            if tx is None:
+                return not_found()
+            if tx['status'] != 'INITIALIZED':
+                return jsonify({'error_message': 'Invalid status 6 for transaction while authorizing'}), 422
+            approved = random.random() >= reject_rate
+            tx['status'] = 'AUTHORIZED' if approved else 'FAILED'
+            tx['response_code'] = 0 if approved else -1
+            tx['authorization_code'] = f"{random.randint(0, 999999):06d}" if approved else '000000'
+            return jsonify(status_body(tx))
+
+    @app.route(WEBPAY_ENDPOINT + '/<token>', methods=['GET'])
+    def status(token):
+        error = simulate_network()
+        if error:
+            return error
+        tx = find(token)
+        if tx is None:
+            return not_found()
+        return jsonify(status_body(tx))
+
+    @app.route(WEBPAY_ENDPOINT + '/<token>/refunds', methods=['POST'])
+    def refund(token):
+        error = simulate_network()
+        if error:
+            return error
+        data = request.get_json(force=True)
+        with lock:
+            tx = transactions.get(token)
+            if tx is None:
+                return not_found()
+            if tx['status'] != 'AUTHORIZED':
+                return jsonify({'error_message': 'Transaction is not authorized'}), 422
+            tx['status'] = 'REVERSED'
+        return jsonify({'type': 'REVERSED', 'amount': data.get('amount')})
+
+    @app.route('/webpayserver/initTransaction', methods=['GET', 'POST'])
+    def init_transaction():
+        """Formulario de pago: devuelve al comercio como lo haría Webpay"""
+        token = request.values.get('token_ws')
+        tx = find(token)
+        if tx is None:
+            return 'Token inválido', 400
+        return (
+            f'<form id="f" method="post" action="{tx["return_url"]}">'
+            f'<input type="hidden" name="token_ws" value="{token}"></form>'
+            '<script>document.getElementById("f").submit()</script>'
+        )
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor mock de Webpay Plus')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency-ms', type=float, default=200)
+    parser.add_argument('--jitter-ms', type=float, default=50)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--reject-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    app = create_mock_app(args.latency_ms, args.jitter_ms, args.failure_rate, args.reject_rate)
+    print(f"Mock de Webpay escuchando en http://{args.host}:{args.port}")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,33 @@
 from transbank.webpay.webpay_plus.transaction import Transaction, WebpayOptions
 from transbank.common.integration_type import IntegrationType
+from transbank.common.request_service import RequestService
 import os
 from dotenv import load_dotenv
 from datetime import datetime
+from functools import cached_property
 import uuid
 import json
 
 # Cargar variables de entorno
 load_dotenv()
 
+
+class WebpayHostOptions(WebpayOptions):
+    """WebpayOptions que apunta a un host distinto de los de Transbank (ej: servidor mock local)"""
+    def __init__(self, commerce_code, api_key, integration_type, base_url, timeout=600):
+        super().__init__(commerce_code, api_key, integration_type, timeout)
+        self.base_url = base_url.rstrip('/')
+
+
+_sdk_host = RequestService.host.__func__
+
+def _host_with_base_url(cls, options):
+    # El SDK solo conoce los hosts de integración y producción de Transbank
+    return getattr(options, 'base_url', None) or _sdk_host(cls, options)
+
+RequestService.host = classmethod(_host_with_base_url)
+
+
 class WebpayPlus:
     def __init__(self, app=None):
         self.app = app
@@ -17,21 +36,37 @@ class WebpayPlus:
     
     def init_app(self, app):
         self.app = app
+        app.extensions['webpay'] = self
+
+    @cached_property
+    def tx(self):
+        """Cliente de Transbank; se crea en la primera transacción y no al importar la app"""
         # Configurar Webpay usando variables de entorno
         integration_type = IntegrationType.TEST
         commerce_code = os.getenv('WEBPAY_COMMERCE_CODE', '597055555532')  # Fallback para pruebas
         api_key = os.getenv('WEBPAY_API_KEY', '579B532A7440BB0C9079DED94D31EA1615BACEB56610332264630D42D0A36B1C')  # Fallback para pruebas
         
+        # URL base alternativa, ej: http://localhost:8090 para webpay_mock_server.py
+        base_url = os.getenv('WEBPAY_BASE_URL')
+        timeout = int(os.getenv('WEBPAY_TIMEOUT', '600'))
+        
         print("\n=== CONFIGURACIÓN DE WEBPAY ===")
         print(f"Tipo de integración: {integration_type}")
         print(f"Código de comercio: {commerce_code}")
         print(f"API Key: {api_key[:10]}...{api_key[-10:]}")
+        if base_url:
+            print(f"URL base: {base_url}")
         
-        self.tx = Transaction(WebpayOptions(
-            commerce_code=commerce_code,
-            api_key=api_key,
-            integration_type=integration_type
-        ))
+        if base_url:
+            options = WebpayHostOptions(commerce_code, api_key, integration_type, base_url, timeout)
+        else:
+            options = WebpayOptions(
+                commerce_code=commerce_code,
+                api_key=api_key,
+                integration_type=integration_type,
+                timeout=timeout
+            )
+        return Transaction(options)
     
     def generate_buy_order(self):
         """Genera un número de orden único"""
@@ -169,7 +169,7 @@ def app(test_config):
         
         # Intentar importar la aplicación real
         from flask_app.app import app as real_app
-        from flask_app.app import db
+        from flask_app.app import catalog_cache, db
         
         # Update app config with test configuration
         real_app.config.update(test_config)
@@ -180,6 +180,8 @@ def app(test_config):
             try:
                 db.drop_all()
                 db.create_all()
+                # Cada test parte con el catálogo vacío: descartar lo cacheado por tests anteriores
+                catalog_cache.bump()
                 yield real_app
             finally:
                 try:
@@ -345,6 +347,29 @@ def runner(app):
     return app.test_cli_runner()
 
 
+@pytest.fixture
+def sqlite_app(tmp_path):
+    """Minimal app (Flask-SQLAlchemy only) on a temporary SQLite file, for module-level tests."""
+    from flask import Flask
+
+    import models  # noqa: F401  Registra las tablas en los metadatos
+    from extensions import db as extensions_db
+
+    sqlite_app = Flask(__name__)
+    sqlite_app.config.update({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+        # SQLite serializa las escrituras: esperar el lock en vez de fallar
+        "SQLALCHEMY_ENGINE_OPTIONS": {"connect_args": {"timeout": 30}},
+    })
+    extensions_db.init_app(sqlite_app)
+    with sqlite_app.app_context():
+        extensions_db.create_all()
+        yield sqlite_app
+        extensions_db.session.remove()
+        extensions_db.engine.dispose()
+
+
 @pytest.fixture
 def test_order(app, test_user, test_product):
     """Create a test order."""
@@ -0,0 +1,106 @@
+"""
+Tests de la caché versionada del catálogo
+Dos instancias de CatalogCache sobre el mismo archivo simulan dos workers
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add flask-app directory to Python path
+flask_app_path = str(Path(__file__).parent.parent / "flask-app")
+if flask_app_path not in sys.path:
+    sys.path.append(flask_app_path)
+
+import catalog_cache
+from catalog_cache import CatalogCache, SQLiteCatalogStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteCatalogStore(str(tmp_path / "catalog.sqlite3"))
+
+
+def test_second_worker_reads_from_shared_tier(store):
+    """El primer worker consulta la base de datos; el segundo usa el nivel compartido"""
+    loads = []
+    worker_a, worker_b = CatalogCache(store), CatalogCache(store)
+
+    assert worker_a.get_or_load("home", lambda: loads.append(1) or {"featured": [1, 2]}) == {"featured": [1, 2]}
+    assert worker_a.get_or_load("home", lambda: loads.append(1)) == {"featured": [1, 2]}
+    assert worker_b.get_or_load("home", lambda: loads.append(1)) == {"featured": [1, 2]}
+    assert len(loads) == 1
+
+
+def test_bump_invalidates_every_worker(store):
+    """Un bump() en un worker hace que el otro deje de usar su LRU"""
+    worker_a, worker_b = CatalogCache(store), CatalogCache(store)
+    assert worker_b.get_or_load("product:1", lambda: {"name": "Martillo"})["name"] == "Martillo"
+
+    worker_a.bump()
+    assert worker_b.get_or_load("product:1", lambda: {"name": "Martillo XL"})["name"] == "Martillo XL"
+    # Los productos inexistentes también se cachean
+    assert worker_b.get_or_load("product:2", lambda: None) is None
+    assert worker_a.get_or_load("product:2", lambda: {"name": "no debería cargarse"}) is None
+
+
+def test_lru_is_bounded(store):
+    """El LRU de cada worker descarta las entradas menos usadas"""
+    cache = CatalogCache(store, max_entries=2)
+    for name in ("a", "b", "a", "c"):
+        cache.get_or_load(name, lambda: name)
+    assert [key.split(":", 1)[1] for key in cache._entries] == ["a", "c"]
+
+
+def test_expired_entries_are_purged_on_set(store):
+    """Las entradas vencidas se eliminan al escribir, sin esperar a un bump()"""
+    store.set("1:products?x=1", "viejo", ttl=-1)
+    store.set("1:products?x=2", "nuevo", ttl=60)
+    with store._connect() as conn:
+        keys = [row[0] for row in conn.execute("SELECT key FROM catalog_entries")]
+    assert keys == ["1:products?x=2"]
+
+
+class FlakyStore(SQLiteCatalogStore):
+    """Nivel compartido que falla mientras `down` sea verdadero"""
+
+    down = False
+
+    def get_version(self):
+        if self.down:
+            raise ConnectionError("sin conexión")
+        return super().get_version()
+
+    def incr_version(self):
+        if self.down:
+            raise ConnectionError("sin conexión")
+        return super().incr_version()
+
+
+def test_unreachable_store_is_bypassed_and_retried(tmp_path, monkeypatch):
+    """Sin nivel compartido se consulta la base de datos y el bump pendiente se aplica al volver"""
+    clock = [1000.0]
+    monkeypatch.setattr(catalog_cache.time, "monotonic", lambda: clock[0])
+    store = FlakyStore(str(tmp_path / "catalog.sqlite3"))
+    cache = CatalogCache(store, retry=30)
+    assert cache.get_or_load("product:1", lambda: "v1") == "v1"
+
+    store.down = True
+    assert cache.bump() is None
+    store.down = False
+    # Dentro de la ventana de reintento no se usa el nivel compartido ni el LRU
+    assert cache.get_or_load("product:1", lambda: "v2") == "v2"
+
+    clock[0] += 31
+    assert cache.get_or_load("product:1", lambda: "v3") == "v3"
+    assert store.get_version() == 2
+
+
+def test_sqlite_store_outside_temp_dir(tmp_path, monkeypatch):
+    """El archivo SQLite no puede quedar en /tmp (PrivateTmp lo aísla por servicio)"""
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    monkeypatch.setenv("CATALOG_CACHE_PATH", str(tmp_path / "catalog.sqlite3"))
+    monkeypatch.setattr(catalog_cache.tempfile, "gettempdir", lambda: str(tmp_path))
+    with pytest.raises(ValueError):
+        catalog_cache.create_catalog_store()
@@ -0,0 +1,60 @@
+"""
+Tests del circuit breaker usado con la API del Banco Central
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# Add flask-app directory to Python path
+flask_app_path = str(Path(__file__).parent.parent / "flask-app")
+if flask_app_path not in sys.path:
+    sys.path.append(flask_app_path)
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+def failing_call():
+    raise ConnectionError("timeout")
+
+
+def test_breaker_opens_after_consecutive_failures():
+    """Tras el umbral de errores las llamadas fallan sin ejecutarse"""
+    breaker = CircuitBreaker("api", probe=failing_call, failure_threshold=2, reset_timeout=60)
+    calls = []
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(failing_call)
+    assert breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        breaker.call(calls.append, "no debería ejecutarse")
+    assert calls == []
+
+
+def test_breaker_success_resets_failure_count():
+    """Un éxito entre errores evita que el circuito se abra"""
+    breaker = CircuitBreaker("api", probe=failing_call, failure_threshold=2)
+    with pytest.raises(ConnectionError):
+        breaker.call(failing_call)
+    assert breaker.call(lambda: "ok") == "ok"
+    with pytest.raises(ConnectionError):
+        breaker.call(failing_call)
+    assert breaker.state == "closed"
+
+
+def test_background_probe_closes_breaker():
+    """El hilo de prueba cierra el circuito cuando el servicio vuelve"""
+    breaker = CircuitBreaker("api", probe=lambda: None, failure_threshold=1, reset_timeout=0.05)
+    with pytest.raises(ConnectionError):
+        breaker.call(failing_call)
+    assert breaker.state == "open"
+
+    deadline = time.time() + 2
+    while breaker.state == "open" and time.time() < deadline:
+        time.sleep(0.02)
+    assert breaker.state == "closed"
+    assert breaker.call(lambda: "ok") == "ok"
@@ -0,0 +1,48 @@
+"""
+Tests de la inicialización diferida de los clientes externos
+Crear los clientes al importar la app no debe abrir conexiones ni fallar
+por configuración faltante; eso ocurre en el primer uso.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+from flask import Flask
+
+# Add flask-app directory to Python path
+flask_app_path = str(Path(__file__).parent.parent / "flask-app")
+if flask_app_path not in sys.path:
+    sys.path.append(flask_app_path)
+
+import currency_converter as converter_module
+from webpay_plus import WebpayHostOptions, WebpayPlus
+
+
+def test_converter_without_credentials_fails_on_first_use(monkeypatch, tmp_path):
+    """Sin credenciales el conversor se crea; la conversión falla con ValueError"""
+    monkeypatch.setattr(converter_module, "BDE_EMAIL", None)
+    monkeypatch.setenv("RATE_CACHE_PATH", str(tmp_path / "rates.sqlite3"))
+
+    converter = converter_module.CurrencyConverter()
+    assert "cache" not in converter.__dict__
+
+    with pytest.raises(ValueError, match="Credenciales"):
+        converter.get_exchange_rate("USD")
+    # La caché se abrió recién al consultar una tasa
+    assert "cache" in converter.__dict__
+
+
+def test_webpay_transaction_is_built_on_first_use(monkeypatch, capsys):
+    """init_app no configura Transbank; la primera transacción sí"""
+    monkeypatch.setenv("WEBPAY_BASE_URL", "http://localhost:8090")
+    app = Flask(__name__)
+    webpay = WebpayPlus(app)
+
+    assert app.extensions["webpay"] is webpay
+    assert "tx" not in webpay.__dict__
+    assert "CONFIGURACIÓN DE WEBPAY" not in capsys.readouterr().out
+
+    assert isinstance(webpay.tx.options, WebpayHostOptions)
+    assert webpay.tx is webpay.tx
+    assert "CONFIGURACIÓN DE WEBPAY" in capsys.readouterr().out
@@ -0,0 +1,51 @@
+"""
+Tests de la caché compartida de tasas de cambio
+"""
+
+import sys
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+# Add flask-app directory to Python path
+flask_app_path = str(Path(__file__).parent.parent / "flask-app")
+if flask_app_path not in sys.path:
+    sys.path.append(flask_app_path)
+
+from rate_cache import SQLiteRateCache, business_day, previous_business_day
+
+
+def test_business_day_skips_weekends():
+    """Sábado y domingo usan la tasa del viernes"""
+    assert business_day(datetime(2026, 10, 17, 12, 0)) == date(2026, 10, 16)
+    assert business_day(date(2026, 10, 18)) == date(2026, 10, 16)
+    assert business_day(date(2026, 10, 19)) == date(2026, 10, 19)
+    assert previous_business_day(date(2026, 10, 19)) == date(2026, 10, 16)
+
+
+def test_sqlite_cache_is_shared_between_instances(tmp_path):
+    """Dos instancias sobre el mismo archivo (dos workers) ven las mismas tasas"""
+    path = str(tmp_path / "rates.sqlite3")
+    worker_a = SQLiteRateCache(path)
+    worker_b = SQLiteRateCache(path)
+    day = date(2026, 10, 16)
+
+    assert worker_b.get("F073.TCO.PRE.Z.D", day) is None
+    worker_a.set("F073.TCO.PRE.Z.D", day, 950.5)
+    value, fetched_at = worker_b.get("F073.TCO.PRE.Z.D", day)
+    assert value == 950.5
+    assert fetched_at <= time.time()
+
+
+def test_sqlite_cache_lock_allows_single_refresh(tmp_path):
+    """Solo un worker obtiene el lock de revalidación hasta que se libera o expira"""
+    path = str(tmp_path / "rates.sqlite3")
+    worker_a = SQLiteRateCache(path)
+    worker_b = SQLiteRateCache(path)
+
+    assert worker_a.acquire("USD:2026-10-16")
+    assert not worker_b.acquire("USD:2026-10-16")
+    worker_a.release("USD:2026-10-16")
+    assert worker_b.acquire("USD:2026-10-16")
+    assert worker_a.acquire("EUR:2026-10-16", seconds=-1)
+    assert worker_b.acquire("EUR:2026-10-16")
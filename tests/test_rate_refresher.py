@@ -0,0 +1,77 @@
+"""
+Tests del refresco programado de tasas de cambio
+"""
+
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Add flask-app directory to Python path
+flask_app_path = str(Path(__file__).parent.parent / "flask-app")
+if flask_app_path not in sys.path:
+    sys.path.append(flask_app_path)
+
+from currency_converter import CURRENCY_SERIES, CurrencyConverter
+from rate_cache import SQLiteRateCache
+from rate_refresher import CHILE_TZ, RateRefresher, next_refresh_at, parse_refresh_times
+
+
+def make_converter(path, failing=(), calls=None):
+    """CurrencyConverter sin red sobre una caché SQLite compartida (un worker)"""
+    converter = CurrencyConverter()
+    converter.cache = SQLiteRateCache(path)
+
+    def fetch_rate(currency_code, date=None):
+        if calls is not None:
+            calls.append(currency_code)
+        if currency_code in failing:
+            raise ValueError("Error al conectar con la API del Banco Central")
+        return 950.5
+
+    converter._fetch_rate = fetch_rate
+    return converter
+
+
+def test_next_refresh_follows_publication_times():
+    """El próximo refresco es el siguiente horario de publicación"""
+    times = parse_refresh_times("19:00, 09:30")
+    assert times == [(9, 30), (19, 0)]
+    assert next_refresh_at(datetime(2026, 10, 19, 8, 0, tzinfo=CHILE_TZ), times) == \
+        datetime(2026, 10, 19, 9, 30, tzinfo=CHILE_TZ)
+    assert next_refresh_at(datetime(2026, 10, 19, 20, 0, tzinfo=CHILE_TZ), times) == \
+        datetime(2026, 10, 20, 9, 30, tzinfo=CHILE_TZ)
+
+
+def test_refresh_all_records_freshness_per_series(tmp_path):
+    """Cada serie registra su propio éxito o error"""
+    refresher = RateRefresher(make_converter(str(tmp_path / "rates.sqlite3"), failing={"UTM"}))
+
+    assert refresher.refresh_all() == ["UTM"]
+
+    freshness = refresher.freshness()["series"]
+    assert freshness["USD"]["value"] == 950.5
+    assert freshness["USD"]["fetched"] is True
+    assert freshness["USD"]["age_seconds"] is not None
+    assert freshness["UTM"]["consecutive_failures"] == 1
+    assert freshness["UTM"]["age_seconds"] is None
+    assert "Banco Central" in freshness["UTM"]["last_error"]
+
+
+def test_workers_share_one_fetch_per_series(tmp_path):
+    """Con varios workers, el Banco Central se consulta una vez por serie y horario"""
+    path = str(tmp_path / "rates.sqlite3")
+    calls = []
+    workers = [RateRefresher(make_converter(path, calls=calls)) for _ in range(3)]
+
+    for refresher in workers:
+        assert refresher.refresh_all() == []
+    assert sorted(calls) == sorted(CURRENCY_SERIES)
+    assert workers[2].freshness()["series"]["USD"]["fetched"] is False
+
+    # Siguiente horario de publicación: las tasas anteriores ya no están frescas
+    calls.clear()
+    tick = time.time()
+    for refresher in workers:
+        refresher.refresh_all(fresh_after=tick)
+    assert sorted(calls) == sorted(CURRENCY_SERIES)
@@ -0,0 +1,92 @@
+"""
+Tests del histórico persistente de tasas de cambio
+Usa un conversor falso que simula la API del Banco Central
+"""
+
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+# Add flask-app directory to Python path
+flask_app_path = str(Path(__file__).parent.parent / "flask-app")
+if flask_app_path not in sys.path:
+    sys.path.append(flask_app_path)
+
+from circuit_breaker import CircuitOpenError
+from models import ExchangeRate
+from rate_store import RateSourceError, get_historical_rate, get_rate_range
+
+
+class FakeBancoCentral:
+    """Devuelve una observación por día; fines de semana sin valor (ND)"""
+
+    def __init__(self):
+        self.requests = []
+
+    def _fetch_observations(self, currency_code, start_date, end_date):
+        self.requests.append((start_date, end_date))
+        observations = []
+        day = start_date
+        while day <= end_date:
+            business = day.weekday() < 5
+            observations.append({
+                "indexDateString": day.strftime("%d-%m-%Y"),
+                "value": f"{39000 + day.day}.50" if business else "NaN",
+                "statusCode": "OK" if business else "ND",
+            })
+            day += timedelta(days=1)
+        return observations
+
+
+def test_range_is_served_from_table_after_backfill(sqlite_app):
+    """La primera consulta descarga el rango; las siguientes no llaman a la API"""
+    api = FakeBancoCentral()
+    rates = get_rate_range(api, "UF", date(2026, 9, 1), date(2026, 9, 30))
+
+    assert len(rates) == 22  # días hábiles de septiembre 2026
+    assert rates[0] == (date(2026, 9, 1), ExchangeRate.query.first().value)
+    assert api.requests == [(date(2026, 9, 1), date(2026, 9, 30))]
+    # Los fines de semana quedan registrados sin valor para no volver a pedirlos
+    assert ExchangeRate.query.count() == 30
+
+    get_rate_range(api, "UF", date(2026, 9, 10), date(2026, 9, 20))
+    assert len(api.requests) == 1
+
+
+def test_only_missing_dates_are_backfilled(sqlite_app):
+    """Un rango que se superpone con datos guardados solo pide los tramos faltantes"""
+    api = FakeBancoCentral()
+    get_rate_range(api, "UF", date(2026, 9, 1), date(2026, 9, 30))
+    get_rate_range(api, "UF", date(2026, 8, 25), date(2026, 10, 5))
+
+    assert api.requests[1:] == [
+        (date(2026, 8, 25), date(2026, 8, 31)),
+        (date(2026, 10, 1), date(2026, 10, 5)),
+    ]
+
+
+def test_historical_rate_uses_last_published_value(sqlite_app):
+    """Un domingo usa la tasa del viernes anterior"""
+    api = FakeBancoCentral()
+    assert get_historical_rate(api, "UF", date(2026, 9, 13)) == 39011.5
+
+    with pytest.raises(ValueError):
+        get_rate_range(api, "UF", date(2026, 9, 30), date(2026, 9, 1))
+
+
+def test_api_failure_is_not_a_client_error(sqlite_app):
+    """Una falla del Banco Central se distingue de un rango inválido"""
+    api = FakeBancoCentral()
+    api._fetch_observations = Mock(side_effect=ValueError("Error al conectar con la API del Banco Central"))
+
+    with pytest.raises(RateSourceError):
+        get_rate_range(api, "UF", date(2026, 9, 1), date(2026, 9, 30))
+    api._fetch_observations.side_effect = CircuitOpenError("API del Banco Central no disponible temporalmente")
+    with pytest.raises(CircuitOpenError):
+        get_rate_range(api, "UF", date(2026, 9, 1), date(2026, 9, 30))
+    with pytest.raises(ValueError) as error:
+        get_rate_range(api, "XYZ", date(2026, 9, 1), date(2026, 9, 30))
+    assert not isinstance(error.value, RateSourceError)
@@ -0,0 +1,107 @@
+"""
+Tests del barrido de reconciliación de Webpay
+Usa un Transaction de Transbank simulado: no hay llamadas de red
+"""
+
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest.mock import Mock
+
+# Add flask-app directory to Python path
+flask_app_path = str(Path(__file__).parent.parent / "flask-app")
+if flask_app_path not in sys.path:
+    sys.path.append(flask_app_path)
+
+from extensions import db
+from models import EmailOutbox, Order, OrderItem, Product, User, WebpayTransaction
+from reconciliation import sweep_stale_transactions
+from webpay_plus import WebpayPlus
+
+
+def make_webpay(statuses):
+    """WebpayPlus con el Transaction de Transbank reemplazado por un mock"""
+    webpay = WebpayPlus.__new__(WebpayPlus)
+    webpay.tx = Mock()
+
+    def status(token):
+        if statuses[token] is None:
+            raise RuntimeError("Transbank no disponible")
+        return statuses[token]
+
+    webpay.tx.status.side_effect = status
+    return webpay
+
+
+def add_transaction(user, product, token, age_minutes):
+    order = Order(user_id=user.id, total_amount=2000, status="pending")
+    db.session.add(order)
+    db.session.flush()
+    db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=2, price_at_time=1000))
+    db.session.add(WebpayTransaction(
+        order_id=order.id,
+        buy_order=f"OC-{token}",
+        token_ws=token,
+        amount=2000,
+        status="pending",
+        created_at=datetime.now(timezone.utc) - timedelta(minutes=age_minutes),
+    ))
+    return order
+
+
+def test_sweep_updates_transactions_and_orders(sqlite_app):
+    """Cada estado de Webpay se refleja en la transacción y en su orden"""
+    user = User(username="sweep", email="sweep@test.cl", password="x")
+    product = Product(name="Taladro", price=1000, stock=10)
+    db.session.add_all([user, product])
+    db.session.flush()
+    for token in ("aprobado", "rechazado", "abandonado", "caido", "reciente"):
+        add_transaction(user, product, token, age_minutes=5 if token == "reciente" else 120)
+    db.session.commit()
+
+    webpay = make_webpay({
+        "aprobado": {"status": "AUTHORIZED", "response_code": 0, "amount": 2000},
+        "rechazado": {"status": "FAILED", "response_code": -1},
+        "abandonado": {"status": "INITIALIZED"},
+        "caido": None,
+    })
+    results = sweep_stale_transactions(webpay, batch_size=2, max_workers=4)
+
+    assert results == {"completed": 1, "review": 0, "failed": 1, "cancelled": 1, "skipped": 0, "error": 1}
+    statuses = {t.token_ws: (t.status, t.order.status) for t in WebpayTransaction.query.all()}
+    assert statuses == {
+        "aprobado": ("completed", "completed"),
+        "rechazado": ("failed", "failed"),
+        "abandonado": ("cancelled", "cancelled"),
+        "caido": ("pending", "pending"),
+        "reciente": ("pending", "pending"),
+    }
+    # Las órdenes cerradas devuelven su stock y la aprobada encola el comprobante
+    assert db.session.get(Product, product.id).stock == 14
+    assert EmailOutbox.query.filter_by(recipient="sweep@test.cl").count() == 1
+    assert webpay.tx.status.call_count == 4
+
+
+def test_sqlite_approved_transaction_of_closed_order(sqlite_app):
+    """Una aprobación tardía vuelve a reservar el stock de la orden cerrada o la deja en revisión"""
+    user = User(username="tardio", email="tardio@test.cl", password="x")
+    product = Product(name="Sierra", price=1000, stock=3)
+    db.session.add_all([user, product])
+    db.session.flush()
+    # Ambas órdenes ya fueron cerradas por reconcile_orders_without_token() y su stock liberado
+    for token in ("con-stock", "sin-stock"):
+        add_transaction(user, product, token, age_minutes=120).status = "failed"
+    db.session.commit()
+
+    approved = {"status": "AUTHORIZED", "response_code": 0, "amount": 2000}
+    results = sweep_stale_transactions(make_webpay({"con-stock": approved, "sin-stock": approved}))
+
+    assert results["completed"] == 1 and results["review"] == 1
+    statuses = {t.token_ws: (t.status, t.order.status) for t in WebpayTransaction.query.all()}
+    assert statuses == {
+        "con-stock": ("completed", "completed"),
+        "sin-stock": ("completed", "review"),
+    }
+    # Solo la orden completada volvió a descontar sus 2 unidades
+    assert db.session.get(Product, product.id).stock == 1
+    assert EmailOutbox.query.filter_by(recipient="tardio@test.cl").count() == 2
@@ -19,6 +19,26 @@ def test_home_page(client):
     assert "Ferremas".encode("utf-8") in response.data
 
 
+def test_home_serves_cached_fragments(client, app, test_category, mocker):
+    """Test home sections are rendered once per catalog version; the header per user"""
+    import flask_app.app as app_module
+
+    assert test_category.name.encode("utf-8") in client.get("/").data
+    render = mocker.spy(app_module, "render_home_fragments")
+
+    other = app.test_client()
+    with other.session_transaction() as sess:
+        sess["user"] = {"name": "Cliente Campaña", "email": "campana@test.cl"}
+    response = other.get("/")
+    assert "Cliente Campaña".encode("utf-8") in response.data
+    assert test_category.name.encode("utf-8") in response.data
+    assert render.call_count == 0
+
+    client.post("/api/products", data={"name": "Nuevo", "price": "1000"})
+    client.get("/")
+    assert render.call_count == 1
+
+
 def test_product_listing(client, test_product):
     """Test product listing page"""
     response = client.get(f"/categoria/{test_product.category_id}")
@@ -163,6 +183,22 @@ def test_update_cart(client, test_user, test_product, app):
         assert data["quantity"] == 2
 
 
+def test_cart_summary_etag(client, test_user, test_product):
+    """Test cart summary endpoint and its conditional GET"""
+    client.post("/login", data={"email": test_user.email, "password": "password123"})
+    client.post("/api/cart/add", json={"product_id": test_product.id, "quantity": 2})
+
+    response = client.get("/api/cart/summary")
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data["item_count"] == 2
+    assert data["line_count"] == 1
+
+    etag = response.headers["ETag"]
+    response = client.get("/api/cart/summary", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
 def test_remove_from_cart(client, test_user, test_product, app):
     """Test removing item from cart"""
     # Login first
@@ -184,6 +220,37 @@ def test_remove_from_cart(client, test_user, test_product, app):
         assert db.session.get(CartItem, item_id) is None
 
 
+def test_cart_batch_operations(client, test_user, test_product, app):
+    """Test applying several cart operations in one request"""
+    client.post("/login", data={"email": test_user.email, "password": "password123"})
+
+    response = client.post(
+        "/api/cart/batch",
+        json={"operations": [
+            {"op": "add", "product_id": test_product.id, "quantity": 1},
+            {"op": "add", "product_id": test_product.id, "quantity": 2},
+        ]},
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert len(data) == 1
+    assert data[0]["quantity"] == 3
+
+    # Una operación inválida revierte todo el lote
+    item_id = data[0]["id"]
+    response = client.post(
+        "/api/cart/batch",
+        json={"operations": [
+            {"op": "update", "item_id": item_id, "quantity": 1},
+            {"op": "remove", "item_id": 999999},
+        ]},
+    )
+    assert response.status_code == 404
+    assert json.loads(response.data)["index"] == 1
+    with app.app_context():
+        assert db.session.get(CartItem, item_id).quantity == 3
+
+
 def test_currency_converter_page(client):
     """Test currency converter page loads"""
     response = client.get("/conversor-moneda")
@@ -191,6 +258,31 @@ def test_currency_converter_page(client):
     assert "conversor".encode("utf-8") in response.data.lower()
 
 
+def test_convert_batch(client, mocker):
+    """Test batch conversion resolves each currency once and uses Decimal results"""
+    import flask_app.app as app_module
+
+    rates = {"USD": (950.5, False), "EUR": (1050.3, False)}
+    get_rate = mocker.patch.object(
+        app_module.currency_converter, "get_rate_info", side_effect=rates.get
+    )
+    response = client.post(
+        "/api/convert/batch",
+        json={"amounts": [1, "2.5", 0.1], "currencies": ["USD", "EUR", "USD"]},
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert [r["converted"] for r in data["results"]] == ["950.50", "2625.75", "95.05"]
+    assert data["stale"] is False
+    assert get_rate.call_count == 2
+
+    response = client.post(
+        "/api/convert/batch", json={"amounts": [1, -5], "currencies": "USD"}
+    )
+    assert response.status_code == 400
+    assert json.loads(response.data)["index"] == 1
+
+
 def test_contact_page(client):
     """Test contact page loads"""
     response = client.get("/contacto")
@@ -216,6 +308,117 @@ def test_send_contact_email(client):
     assert data["message"] == "Mensaje enviado correctamente"
 
 
+def test_get_products_paginated(client, test_product):
+    """Test keyset pagination and filters on the products API"""
+    response = client.get("/api/products", query_string={"limit": 1})
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert len(data["items"]) == 1
+    assert "next_cursor" in data
+
+    response = client.get(
+        "/api/products",
+        query_string={"category_id": test_product.category_id, "max_price": 1000},
+    )
+    data = json.loads(response.data)
+    assert any(item["id"] == test_product.id for item in data["items"])
+
+    response = client.get("/api/products", query_string={"cursor": "no-es-cursor"})
+    assert response.status_code == 400
+
+
+def test_catalog_cache_invalidated_by_writes(client, test_product):
+    """Test cached catalog reads skip the database until a product is modified"""
+    import flask_app.app as app_module
+
+    assert client.get(f"/api/products/{test_product.id}").get_json()["name"] == test_product.name
+    with mock_queries(app_module) as queries:
+        assert client.get(f"/api/products/{test_product.id}").status_code == 200
+        assert client.get(f"/product/{test_product.id}").status_code == 200
+    assert queries == []
+
+    response = client.put(f"/api/products/{test_product.id}", data={"name": "Martillo XL"})
+    assert response.status_code == 200
+    assert client.get(f"/api/products/{test_product.id}").get_json()["name"] == "Martillo XL"
+
+    client.delete(f"/api/products/{test_product.id}")
+    assert client.get(f"/api/products/{test_product.id}").status_code == 404
+
+
+def test_products_cache_key_ignores_unknown_params(client, test_product, mocker):
+    """Test unknown query parameters reuse the cached page instead of adding entries"""
+    import flask_app.app as app_module
+
+    assert client.get("/api/products?limit=5").status_code == 200
+    load = mocker.spy(app_module.catalog_cache, "get_or_load")
+    with mock_queries(app_module) as queries:
+        for i in range(3):
+            assert client.get(f"/api/products?limit=5&x={i}").status_code == 200
+    assert queries == []
+    assert {call.args[0] for call in load.call_args_list} == {"products?after_id=0&limit=5"}
+
+
+def test_catalog_conditional_get(client, test_product, test_category):
+    """Test catalog routes answer 304 when the client already has the current version"""
+    for path in ("/api/products", f"/api/products/{test_product.id}", "/api/categories"):
+        response = client.get(path)
+        etag = response.headers["ETag"]
+        assert response.headers["Cache-Control"] == "no-cache"
+
+        response = client.get(path, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.data == b""
+        assert client.get(path, headers={"If-None-Match": '"otra-version"'}).status_code == 200
+
+    response = client.get(f"/api/products/{test_product.id}")
+    last_modified = response.headers["Last-Modified"]
+    assert client.get(
+        f"/api/products/{test_product.id}", headers={"If-Modified-Since": last_modified}
+    ).status_code == 304
+
+
+def test_export_products_streams_ndjson(client, test_product, mocker):
+    """Test the catalog export streams one product per line in batches"""
+    import flask_app.app as app_module
+
+    mocker.patch.object(app_module, "PRODUCTS_EXPORT_BATCH_SIZE", 1)
+    client.post("/api/products", data={"name": "Serrucho", "price": "5990"})
+
+    response = client.get("/api/products/export", buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    chunks = list(response.response)
+    response.close()
+    assert len(chunks) == 2
+    products = [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+    assert [p["name"] for p in products] == [test_product.name, "Serrucho"]
+    assert {"stock", "category_id", "updated_at"} <= products[0].keys()
+
+    assert client.get("/api/products/export?category_id=abc").status_code == 400
+
+
+def mock_queries(app_module):
+    """Registra las sentencias SQL ejecutadas dentro del bloque"""
+    from contextlib import contextmanager
+
+    from sqlalchemy import event
+
+    @contextmanager
+    def capture():
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(app_module.db.engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(app_module.db.engine, "before_cursor_execute", record)
+
+    return capture()
+
+
 def test_get_categories(client, test_category):
     """Test getting all categories"""
     response = client.get("/api/categories")
@@ -257,6 +460,204 @@ def test_webpay_payment_flow(client, test_user, test_product, app):
         assert transaction.status == "pending"
 
 
+def test_webpay_failure_marks_order_failed(client, test_user, test_product, app, mocker):
+    """Test a failed Webpay call closes the order and keeps the cart"""
+    import flask_app.app as app_module
+
+    client.post("/login", data={"email": test_user.email, "password": "password123"})
+    client.post("/api/cart/add", json={"product_id": test_product.id, "quantity": 1})
+
+    mocker.patch.object(
+        app_module.webpay, "create_transaction", side_effect=RuntimeError("timeout")
+    )
+    response = client.post("/iniciar-pago")
+    assert response.status_code == 500
+
+    with app.app_context():
+        transaction = WebpayTransaction.query.first()
+        assert transaction.token_ws is None
+        assert transaction.status == "failed"
+        assert transaction.order.status == "failed"
+        assert CartItem.query.filter_by(user_id=test_user.id).count() == 1
+
+
+def start_checkout(client, app_module, mocker, token):
+    """Inicia un pago con Webpay simulado que entrega el token indicado"""
+    mocker.patch.object(
+        app_module.webpay,
+        "create_transaction",
+        return_value={"token": token, "url": "https://webpay.test"},
+    )
+    return client.post("/iniciar-pago")
+
+
+def test_checkout_reserves_and_releases_stock(client, test_user, test_product, app, mocker):
+    """Test checkout holds stock until Webpay rejects or the user cancels the payment"""
+    import flask_app.app as app_module
+    from flask_app.models import Product
+
+    def stock():
+        with app.app_context():
+            return db.session.get(Product, test_product.id).stock
+
+    initial = stock()
+    client.post("/login", data={"email": test_user.email, "password": "password123"})
+
+    client.post("/api/cart/add", json={"product_id": test_product.id, "quantity": 2})
+    assert start_checkout(client, app_module, mocker, "token-rechazo").status_code == 200
+    assert stock() == initial - 2
+    mocker.patch.object(app_module.webpay, "commit_transaction", return_value={"response_code": -1})
+    client.post("/retorno-webpay", data={"token_ws": "token-rechazo"})
+    assert stock() == initial
+
+    client.post("/api/cart/add", json={"product_id": test_product.id, "quantity": 2})
+    assert start_checkout(client, app_module, mocker, "token-anulado").status_code == 200
+    assert stock() == initial - 2
+    client.post("/retorno-webpay", data={"TBK_TOKEN": "token-anulado"})
+    assert stock() == initial
+    with app.app_context():
+        assert [order.status for order in Order.query.order_by(Order.id)] == ["failed", "cancelled"]
+
+
+def test_checkout_insufficient_stock(client, test_user, test_product, app, mocker):
+    """Test checkout is rejected when stock ran out after the item was added to the cart"""
+    import flask_app.app as app_module
+    from flask_app.models import Product
+
+    client.post("/login", data={"email": test_user.email, "password": "password123"})
+    client.post("/api/cart/add", json={"product_id": test_product.id, "quantity": 2})
+    with app.app_context():
+        db.session.get(Product, test_product.id).stock = 1
+        db.session.commit()
+
+    response = start_checkout(client, app_module, mocker, "token-sin-stock")
+    assert response.status_code == 400
+    with app.app_context():
+        assert db.session.get(Product, test_product.id).stock == 1
+        assert Order.query.count() == 0
+
+
+def test_late_approval_after_reconciliation(client, test_user, test_product, app, mocker):
+    """Test an approval for an order already closed re-reserves its stock or flags it for review"""
+    import flask_app.app as app_module
+    from flask_app.models import Product
+    from flask_app.stock import close_pending_orders
+
+    client.post("/login", data={"email": test_user.email, "password": "password123"})
+    mocker.patch.object(app_module.webpay, "commit_transaction", return_value={"response_code": 0, "amount": 1})
+
+    for token, remaining in (("token-tardio", 10), ("token-revision", 0)):
+        client.post("/api/cart/add", json={"product_id": test_product.id, "quantity": 1})
+        start_checkout(client, app_module, mocker, token)
+        with app.app_context():
+            # La reconciliación cierra la orden y libera su stock antes del retorno
+            order_id = WebpayTransaction.query.filter_by(token_ws=token).one().order_id
+            close_pending_orders([order_id], "failed")
+            db.session.get(Product, test_product.id).stock = remaining
+            db.session.commit()
+
+        client.post("/retorno-webpay", data={"token_ws": token})
+        with app.app_context():
+            product = db.session.get(Product, test_product.id)
+            if remaining:
+                assert db.session.get(Order, order_id).status == "completed"
+                assert product.stock == remaining - 1
+            else:
+                assert db.session.get(Order, order_id).status == "review"
+                assert product.stock == 0
+
+
+def test_iniciar_pago_idempotency_key(client, test_user, test_product, app, mocker):
+    """Test a repeated Idempotency-Key returns the stored response"""
+    import flask_app.app as app_module
+
+    client.post("/login", data={"email": test_user.email, "password": "password123"})
+    client.post("/api/cart/add", json={"product_id": test_product.id, "quantity": 1})
+
+    create = mocker.patch.object(
+        app_module.webpay,
+        "create_transaction",
+        return_value={"token": "token-idem", "url": "https://webpay.test"},
+    )
+    headers = {"Idempotency-Key": "pago-1"}
+    first = client.post("/iniciar-pago", headers=headers)
+    second = client.post("/iniciar-pago", headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert json.loads(first.data) == json.loads(second.data)
+    assert create.call_count == 1
+    with app.app_context():
+        assert Order.query.filter_by(user_id=test_user.id).count() == 1
+
+
+def test_iniciar_pago_abandoned_reservation(client, test_user, test_product, app, mocker):
+    """Test a reservation left by a dead request answers 409 until it expires, then is taken over"""
+    from datetime import datetime, timedelta, timezone
+
+    import flask_app.app as app_module
+    from flask_app.models import IdempotencyKey
+
+    client.post("/login", data={"email": test_user.email, "password": "password123"})
+    client.post("/api/cart/add", json={"product_id": test_product.id, "quantity": 1})
+    with app.app_context():
+        # Reserva de una solicitud cuyo worker murió antes de guardar la respuesta
+        db.session.add(IdempotencyKey(user_id=test_user.id, scope="iniciar-pago", key="pago-1"))
+        db.session.commit()
+
+    mocker.patch.object(
+        app_module.webpay,
+        "create_transaction",
+        return_value={"token": "token-idem", "url": "https://webpay.test"},
+    )
+    headers = {"Idempotency-Key": "pago-1"}
+    assert client.post("/iniciar-pago", headers=headers).status_code == 409
+
+    with app.app_context():
+        IdempotencyKey.query.update({"created_at": datetime.now(timezone.utc) - timedelta(hours=1)})
+        db.session.commit()
+    assert client.post("/iniciar-pago", headers=headers).status_code == 200
+    with app.app_context():
+        assert IdempotencyKey.query.one().response_body is not None
+        assert Order.query.filter_by(user_id=test_user.id).count() == 1
+
+
+def test_retorno_webpay_enqueues_receipt(client, test_user, test_product, app, mocker):
+    """Test a completed payment queues the receipt instead of sending it inline"""
+    import flask_app.app as app_module
+    from flask_app.email_outbox import drain_outbox
+    from flask_app.models import EmailOutbox
+
+    client.post("/login", data={"email": test_user.email, "password": "password123"})
+    client.post("/api/cart/add", json={"product_id": test_product.id, "quantity": 1})
+    mocker.patch.object(
+        app_module.webpay,
+        "create_transaction",
+        return_value={"token": "token-outbox", "url": "https://webpay.test"},
+    )
+    client.post("/iniciar-pago")
+
+    mocker.patch.object(
+        app_module.webpay,
+        "commit_transaction",
+        return_value={"response_code": 0, "amount": test_product.price},
+    )
+    send = mocker.patch.object(app_module.mail, "send")
+    response = client.post("/retorno-webpay", data={"token_ws": "token-outbox"})
+    assert response.status_code == 302
+    assert send.call_count == 0
+
+    with app.test_request_context():
+        entry = EmailOutbox.query.one()
+        assert entry.status == "pending"
+        assert entry.recipient == test_user.email
+
+        mail = mocker.MagicMock()
+        connection = mail.connect.return_value.__enter__.return_value
+        assert drain_outbox(mail) == (1, 0)
+        assert connection.send.call_count == 1
+        assert EmailOutbox.query.one().status == "sent"
+
+
 def test_checkout_unauthorized(client):
     """Test checkout page requires authentication"""
     response = client.get("/checkout")
@@ -272,3 +673,32 @@ def test_checkout_empty_cart(client, test_user):
     response = client.get("/checkout")
     assert response.status_code == 302  # Redirect to cart
     assert "/carrito" in response.headers["Location"]
+
+
+def test_create_app_builds_independent_apps(tmp_path):
+    """Test the factory returns a new, fully wired app on each call"""
+    import flask_app.app as app_module
+
+    other = app_module.create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'other.db'}"})
+    assert other is not app_module.app
+    assert set(other.view_functions) == set(app_module.app.view_functions)
+    assert "reconcile-payments" in other.cli.commands
+    with other.test_request_context():
+        assert db.engine.url.database.endswith("other.db")
+
+
+def test_init_worker_discards_inherited_connections(tmp_path, mocker):
+    """Test the post-fork hook disposes the parent's pool and warms the worker"""
+    import flask_app.app as app_module
+
+    worker_app = app_module.create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'worker.db'}"})
+    mocker.patch.object(app_module, "RATE_PREFETCH", False)
+    load_rates = mocker.patch.object(app_module.currency_converter, "load_cached_rates", return_value=4)
+    with worker_app.app_context():
+        dispose = mocker.spy(db.engine, "dispose")
+
+    app_module.init_worker(worker_app)
+
+    dispose.assert_called_once_with(close=False)
+    assert load_rates.call_count == 1
+    assert worker_app.jinja_env.cache
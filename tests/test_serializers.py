@@ -0,0 +1,32 @@
+"""
+Tests del camino rápido de serialización (tuplas de columnas + orjson)
+Debe entregar exactamente los mismos datos que los esquemas de marshmallow
+"""
+
+import json
+import sys
+from pathlib import Path
+
+# Add flask-app directory to Python path
+flask_app_path = str(Path(__file__).parent.parent / "flask-app")
+if flask_app_path not in sys.path:
+    sys.path.append(flask_app_path)
+
+import serializers
+from serialization_benchmark import run_benchmark
+
+
+def test_fast_path_matches_marshmallow(tmp_path):
+    """El benchmark compara ambos caminos y falla si los datos difieren"""
+    results = run_benchmark(f"sqlite:///{tmp_path / 'catalog.db'}", sizes=(50,), repeat=1)
+    assert results[0]["products"] == 50
+    assert results[0]["fast_total_ms"] > 0
+
+
+def test_dumps_without_orjson(monkeypatch):
+    """Sin orjson se usa json de la biblioteca estándar con la misma salida"""
+    data = {"name": "Taladro Percutor", "price": 49990.0, "promotion_price": None, "is_promotion": False}
+    fast = serializers.dumps(data)
+    monkeypatch.setattr(serializers, "orjson", None)
+    assert serializers.dumps(data) == fast
+    assert json.loads(fast) == data
@@ -0,0 +1,37 @@
+"""
+Tests de contención de stock
+Verifica que reserve_stock() no sobrevende con muchos compradores concurrentes
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add flask-app directory to Python path
+flask_app_path = str(Path(__file__).parent.parent / "flask-app")
+if flask_app_path not in sys.path:
+    sys.path.append(flask_app_path)
+
+from stock_benchmark import run_benchmark
+
+
+@pytest.mark.slow
+def test_hot_sku_contention_never_oversells(tmp_path):
+    """Muchos compradores sobre un mismo SKU: el stock nunca queda negativo"""
+    database_url = f"sqlite:///{tmp_path / 'stock.db'}"
+    stats = run_benchmark(database_url, buyers=10, attempts=15, stock=60)
+
+    assert stats["reserved"] == 60
+    assert stats["final_stock"] == 0
+    assert stats["throughput_per_s"] > 0
+
+
+@pytest.mark.slow
+def test_contention_with_enough_stock(tmp_path):
+    """Con stock suficiente todas las reservas concurrentes se concretan"""
+    database_url = f"sqlite:///{tmp_path / 'stock.db'}"
+    stats = run_benchmark(database_url, buyers=5, attempts=10, stock=100)
+
+    assert stats["reserved"] == stats["attempts"] == 50
+    assert stats["final_stock"] == 50
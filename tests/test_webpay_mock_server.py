@@ -0,0 +1,52 @@
+"""
+Tests del servidor mock de Webpay Plus usado en las pruebas de carga
+"""
+
+import sys
+from pathlib import Path
+
+# Add flask-app directory to Python path
+flask_app_path = str(Path(__file__).parent.parent / "flask-app")
+if flask_app_path not in sys.path:
+    sys.path.append(flask_app_path)
+
+from webpay_mock_server import WEBPAY_ENDPOINT, create_mock_app
+
+
+def create_transaction(client):
+    response = client.post(WEBPAY_ENDPOINT, json={
+        "buy_order": "OC-1", "session_id": "s-1", "amount": 1000,
+        "return_url": "http://localhost:5000/retorno-webpay",
+    })
+    assert response.status_code == 200
+    return response.get_json()["token"]
+
+
+def test_mock_create_commit_status_refund():
+    """El mock recorre el ciclo completo de una transacción como Transbank"""
+    client = create_mock_app().test_client()
+    token = create_transaction(client)
+    assert len(token) == 64
+    assert client.get(f"{WEBPAY_ENDPOINT}/{token}").get_json()["status"] == "INITIALIZED"
+
+    commit = client.put(f"{WEBPAY_ENDPOINT}/{token}", json={}).get_json()
+    assert commit["status"] == "AUTHORIZED"
+    assert commit["response_code"] == 0
+    # Un segundo commit del mismo token es rechazado
+    assert client.put(f"{WEBPAY_ENDPOINT}/{token}", json={}).status_code == 422
+
+    refund = client.post(f"{WEBPAY_ENDPOINT}/{token}/refunds", json={"amount": 1000})
+    assert refund.get_json()["type"] == "REVERSED"
+    assert client.get(f"{WEBPAY_ENDPOINT}/{token}").get_json()["status"] == "REVERSED"
+
+
+def test_mock_failure_and_reject_rates():
+    """Las tasas configurables producen errores HTTP y pagos rechazados"""
+    failing = create_mock_app(failure_rate=1.0).test_client()
+    assert failing.post(WEBPAY_ENDPOINT, json={}).status_code == 500
+
+    rejecting = create_mock_app(reject_rate=1.0).test_client()
+    token = create_transaction(rejecting)
+    commit = rejecting.put(f"{WEBPAY_ENDPOINT}/{token}", json={}).get_json()
+    assert commit["status"] == "FAILED"
+    assert commit["response_code"] == -1